@@ -23,6 +23,11 @@ where we our problem is similar to this
 
 
 with n modules, and 2*n+1 air regions, and 2*n+1 water regions
+
+------------------------------------
+function tests are run by doctest
+python -m doctest ICSolar.py
+------------------------------------
 """
 
 """ Required Modules """
@@ -30,108 +35,568 @@ import src.blocks as b
 import src.flux as f
 import src.problem as p
 import src.source as s
+import src.stream as st
 """ Optional Modules """
 import csv
 import sys
+import json
+import time
+import threading
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+from collections import deque, OrderedDict
 import matplotlib.pyplot as plt
 import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+class Model(object):
+	""" 
+	Model Class, the ICSolar model built once for n modules
+
+	The blocks, fluxes, sources and the Problem are constructed once,
+	and the inputs, heatGen (the Sw source) and waterTemp (the inlet water
+	state) are declared as Problem parameters, which are rebound before 
+	every solve. The water mass flow rate (waterFlow) and the 
+	heatCondSimple film coefficients (hExt, hInt and hWa) are declared
+	as well, to be calibrated (calibrate.py)
+
+	__init__:		Model Constructor
+
+	input(s):   (n) number of modules
+							(batch) number of operating points solved at once,
+								or None for a single operating point
+	output(s):	None
+	"""
+	def __init__(self,n,batch = None):
+		""" Boundary flux blocks """
+		""" All these blocks remain constant """
+		# define inlet water with initial state
+		w0 = b.Block('waterInlet','constWater',T = 20)
+
+		# define inlet air with initial state
+		a0 = b.Block('airInlet','constAir',T = 20)
+
+		# We will need mass flow rates for our fluxes, so initialize them here
+		# These are added to the class object, and are not part of the
+		# default block requirement
+		w0.mdot = 8.5e-07*w0.m['rho'](w0.state)
+		a0.mdot = 2.0*a0.m['rho'](a0.state)*0.16
+
+		# All these boundary blocks need are temperatures
+		# define Exterior boundary condition
+		aExt = b.Block('Exterior','air',T = 25.0)
+		# define Interior boundary condition
+		aInt = b.Block('Interior','air',T = 22.5)
+
+		""" Sources used in even numbered blocks """
+
+		# Here, constant sources are defined using the optional arguments
+		# to pass in information about the source variable (Temperature)
+		# and its value
+		qw = 0 # Heat flow into water from Module Heat Receiver
+		qa = 0 # Heat flow into air from Heat Loss from the Module
+
+		Sa = s.Source('const',T = qa)
+		Sw = s.Source('const',T = qw)
+		""" Block Initialization """
+
+		# Initial lists of blocks
+		water = []
+		air = []
+
+		# add in the inflow block to make it easy to connect blocks
+		# These blocks are not used in the solve
+		water.append(w0)
+		air.append(a0)
+
+		#### Initialize the blocks we will solve on
+		for i in range(1,2*n+1):
+
+			if(i % 2 == 1): # odd regions are "tube" regions
+				# Every block is named for its material in this case
+				water.append(b.Block('waterTube' + str((i+1)/2),'constWater',T = 15))
+				air.append(b.Block('airTube' + str((i+1)/2),'constAir',T = 22))
+				# Water tube has one flux for heat conduction
+				if( i == 1 ): 
+					water[i].addFlux(f.Flux(air[i],'heatCondSimple',{'type':'wa','m':[],'L':0.15}))
+					# Air has three, corresponding to the windows and the water-tube
+					air[i].addFlux(f.Flux(water[i],'heatCondSimple',{'type':'wa','m':[],'L':0.15}))
+					air[i].addFlux(f.Flux(aInt,'heatCondSimple',{'type':'int','m':[],'L':0.15}))
+					air[i].addFlux(f.Flux(aExt,'heatCondSimple',{'type':'ext','m':[],'L':0.15}))
+				else:
+					water[i].addFlux(f.Flux(air[i],'heatCondSimple',{'type':'wa','m':[],'L':0.3}))
+					air[i].addFlux(f.Flux(water[i],'heatCondSimple',{'type':'wa','m':[],'L':0.3}))
+					air[i].addFlux(f.Flux(aInt,'heatCondSimple',{'type':'int','m':[],'L':0.3}))
+					air[i].addFlux(f.Flux(aExt,'heatCondSimple',{'type':'ext','m':[],'L':0.3}))
+			else: # These are "module" region
+				# Every block is named for its material in this case
+				water.append(b.Block('waterModule' + str(i/2),'water',T = 15))
+				air.append(b.Block('airModule' + str(i/2),'air',T = 22))
+				water[i].addSource(Sw)
+				air[i].addSource(Sa)
+
+			# These are the connectivity between regions, each block takes heat
+			# from the block "below" it
+			air[i].addFlux(f.Flux(air[i-1],'heatConvection'))
+			water[i].addFlux(f.Flux(water[i-1],'heatConvection'))
+
+			# These are needed for window calculations
+			air[i].mdot = a0.mdot
+			water[i].mdot = w0.mdot
+		#### END OF INITIALIZATION
+
+		""" Problem Initialization """
+
+		# Start the problem with solvable blocks, which
+		# are all the blocks except the first two
+		self.air = air
+		self.water = water
+		self.problem = p.Problem(air[1::]+water[1::],array = True,batch = batch)
+		self.problem.declare('heatGen',lambda : -Sw.p['T'],lambda v : Sw.p.__setitem__('T',-v))
+		self.problem.declare('waterTemp',lambda : w0.state['T'],lambda v : w0.state.__setitem__('T',v))
+		self.problem.declare('waterFlow',lambda : w0.mdot, \
+			lambda v : [setattr(ww,'mdot',v) for ww in water])
+		for name, kind in [('hExt','ext'),('hInt','int'),('hWa','wa')]:
+			films = [F for blk in air + water for F in blk.F \
+				if F.f == 'heatCondSimple' and F.G['type'] == kind]
+			self.problem.declare(name,lambda films = films: films[0].G.get('h',f.films[films[0].G['type']]), \
+				lambda v,films = films: [(F.G.__setitem__('h',v),F.setup()) for F in films])
+		# initial guesses, to restart from
+		self.guess = self.problem.getSolution()
+		# LU factors of the Jacobian at the last query, see query
+		self.lu = None
+
+	"""
+	solve:			solves the model for new inputs
+
+	input(s):   (heatGen) heat generation per module
+							(waterTemp) inlet water temperature
+								both are arrays with one entry per operating point 
+								for a batch
+							(method) Problem.solve method
+							(warm) start from the last solution rather than 
+								the initial guesses
+	output(s):	water temperatures of every region, including the inlet
+								with one column per operating point for a batch
+	"""
+	def solve(self,heatGen,waterTemp,method = 'fsolve',warm = False):
+		self.problem.setParameters(heatGen = heatGen,waterTemp = waterTemp)
+		if not warm:
+			self.problem.update(self.guess)
+		self.problem.solve(method)
+		return np.array([ww.state['T'] for ww in self.water],dtype=float)
+
+	"""
+	query:			solves the model for new inputs, near the last ones
+
+	input(s):   (heatGen) heat generation per module
+							(waterTemp) inlet water temperature
+							(tol) absolute tolerance on the residual 2-norm
+							(maxiter) maximum number of chord iterations
+	output(s):	water temperatures of every region, as solve
+
+	starting from the last solution, the Jacobian factored at an earlier
+	query is reused (chord iterations), each iteration costing one residual
+	and one triangular solve. Only if they do not converge quickly is the
+	model solved by Newton, and the Jacobian factored again. If Newton
+	does not converge either, the model goes back to the initial guesses
+	and the factored Jacobian is dropped, so the next query starts afresh.
+	As solve, problem.info['converged'] (and ['rows'] for a batch)
+	tells whether the result can be used
+	"""
+	def query(self,heatGen,waterTemp,tol = 1e-10,maxiter = 8):
+		P = self.problem
+		P.setParameters(heatGen = heatGen,waterTemp = waterTemp)
+		if self.lu is not None:
+			x0 = P.getSolution()
+			x = x0
+			for it in range(maxiter):
+				R = P.r(x)
+				if np.linalg.norm(R) <= tol:
+					P.info = {'iterations':it,'norm':np.linalg.norm(R),'converged':True}
+					if P.batch is not None:
+						P.info['rows'] = np.ones(P.batch,dtype=bool)
+					return np.array([ww.state['T'] for ww in self.water],dtype=float)
+				x = x - self.lu.solve(R)
+			P.update(x0)
+		T = self.solve(heatGen,waterTemp,'newton-sparse',warm = self.lu is not None)
+		if P.info['converged']:
+			self.lu = spla.splu(sp.csc_matrix(P.jacobian(P.getSolution())))
+		else:
+			P.update(self.guess)
+			self.lu = None
+		return T
+
+	"""
+	sensitivities:	derivatives of the outlet water temperature with
+									respect to declared parameters, at the last solution
+
+	input(s):   (names) declared parameter names
+	output(s):	array with a column per parameter, and a row per
+								operating point for a batch
+	"""
+	def sensitivities(self,names):
+		P = self.problem
+		nb = 1 if P.batch is None else P.batch
+		i = P.mapping.index((P.b.index(self.water[-1]),'T'))
+		W = sp.csr_matrix((np.ones(nb),(np.arange(nb),i*nb + np.arange(nb))),shape=(nb,len(P.mapping)*nb))
+		return P.sensitivities(names,W)
+
+# Models already built, by number of modules and batch size, the least
+# recently used first. Only the last few are kept, so that requests for
+# many sizes do not hold a Model each
+models = OrderedDict()
+maxModels = 8
+modelsLock = threading.Lock()
+# one lock per Model being built, so that a size is built only once
+# while the Models of other sizes are still handed out
+building = {}
+
+def compiled(n,batch = None):
+	""" returns the Model for n modules and batch size, building it on first use """
+	key = (n,batch)
+	def cached():
+		with modelsLock:
+			if key in models:
+				models[key] = models.pop(key)
+				return models[key]
+			return building.setdefault(key,threading.Lock())
+	found = cached()
+	if isinstance(found,Model):
+		return found
+	with found:
+		# it may have been built while waiting for the lock
+		found = cached()
+		if isinstance(found,Model):
+			return found
+		model = Model(n,batch)
+		with modelsLock:
+			models[key] = model
+			building.pop(key,None)
+			while len(models) > maxModels:
+				models.popitem(last = False)
+		return model
+
 def solve(heatGen,waterTemp,n):
-	""" Boundary flux blocks """
-	""" All these blocks remain constant """
-	# define inlet water with initial state
-	w0 = b.Block('waterInlet','constWater',T = waterTemp)
-
-	# define inlet air with initial state
-	a0 = b.Block('airInlet','constAir',T = 20)
-
-	# We will need mass flow rates for our fluxes, so initialize them here
-	# These are added to the class object, and are not part of the
-	# default block requirement
-	w0.mdot = 8.5e-07*w0.m['rho'](w0.state)
-	a0.mdot = 2.0*a0.m['rho'](a0.state)*0.16
-
-	# All these boundary blocks need are temperatures
-	# define Exterior boundary condition
-	aExt = b.Block('Exterior','air',T = 25.0)
-	# define Interior boundary condition
-	aInt = b.Block('Interior','air',T = 22.5)
-
-	""" Sources used in even numbered blocks """
-
-	# Here, constant sources are defined using the optional arguments
-	# to pass in information about the source variable (Temperature)
-	# and its value
-	qw = -heatGen # Heat flow into water from Module Heat Receiver
-	qa = 0 # Heat flow into air from Heat Loss from the Module
-
-	Sa = s.Source('const',T = qa)
-	Sw = s.Source('const',T = qw)
-	""" Block Initialization """
-
-	# Initial lists of blocks
-	water = []
-	air = []
-
-	# add in the inflow block to make it easy to connect blocks
-	# These blocks are not used in the solve
-	water.append(w0)
-	air.append(a0)
-
-	#### Initialize the blocks we will solve on
-	for i in range(1,2*n+1):
-
-		if(i % 2 == 1): # odd regions are "tube" regions
-			# Every block is named for its material in this case
-			water.append(b.Block('waterTube' + str((i+1)/2),'constWater',T = 15))
-			air.append(b.Block('airTube' + str((i+1)/2),'constAir',T = 22))
-			# Water tube has one flux for heat conduction
-			if( i == 1 ): 
-				water[i].addFlux(f.Flux(air[i],'heatCondSimple',{'type':'wa','m':[],'L':0.15}))
-				# Air has three, corresponding to the windows and the water-tube
-				air[i].addFlux(f.Flux(water[i],'heatCondSimple',{'type':'wa','m':[],'L':0.15}))
-				air[i].addFlux(f.Flux(aInt,'heatCondSimple',{'type':'int','m':[],'L':0.15}))
-				air[i].addFlux(f.Flux(aExt,'heatCondSimple',{'type':'ext','m':[],'L':0.15}))
-			else:
-				water[i].addFlux(f.Flux(air[i],'heatCondSimple',{'type':'wa','m':[],'L':0.3}))
-				air[i].addFlux(f.Flux(water[i],'heatCondSimple',{'type':'wa','m':[],'L':0.3}))
-				air[i].addFlux(f.Flux(aInt,'heatCondSimple',{'type':'int','m':[],'L':0.3}))
-				air[i].addFlux(f.Flux(aExt,'heatCondSimple',{'type':'ext','m':[],'L':0.3}))
-		else: # These are "module" region
-			# Every block is named for its material in this case
-			water.append(b.Block('waterModule' + str(i/2),'water',T = 15))
-			air.append(b.Block('airModule' + str(i/2),'air',T = 22))
-			water[i].addSource(Sw)
-			air[i].addSource(Sa)
-
-		# These are the connectivity between regions, each block takes heat
-		# from the block "below" it
-		air[i].addFlux(f.Flux(air[i-1],'heatConvection'))
-		water[i].addFlux(f.Flux(water[i-1],'heatConvection'))
-
-		# These are needed for window calculations
-		air[i].mdot = a0.mdot
-		water[i].mdot = w0.mdot
-	#### END OF INITIALIZATION
-
-	""" Problem Initialization """
-
-	# Start the problem with solvable blocks, which
-	# are all the blocks except the first two
-	ICSolar = p.Problem(air[1::]+water[1::])
-	ICSolar.solve()
 	# ICSolar.printSolution()
 	# air[0].printMe()
 	# water[0].printMe()
-	# print a0.mdot
-	# print w0.mdot
+	# heat only moves up the stack, so the regions are solved in turn
+	# from the inlet, see Problem.triangulate
 	mTemp = []
-	for ww in water:
+	for ww in compiled(n).solve(heatGen,waterTemp,'newton-triangular'):
 		# if 'Module' in ww.name:
-		mTemp.append(float(ww.state['T']))
+		mTemp.append(float(ww))
 	return mTemp
+
+def solveBatch(heatGen,waterTemp,n):
+	""" 
+	Solves many operating points at once, heatGen and waterTemp are arrays
+	The blocks hold one temperature per operating point, so the fluxes and 
+	material properties are evaluated over all of them at once, and the
+	global system is block diagonal, which the sparse Newton solver exploits
+
+	returns an array of water temperatures, one row per operating point
+	and one column per region, as in solve. The rows of operating points
+	that did not converge are nan, and can be solved again on their own
+	"""
+	heatGen = np.asarray(heatGen,dtype=float)
+	waterTemp = np.asarray(waterTemp,dtype=float)
+	model = compiled(n,len(heatGen))
+	T = model.solve(heatGen,waterTemp,'newton-sparse').T
+	T[~model.problem.info['rows']] = np.nan
+	return T
+
+def solveSequence(heatGen,waterTemp,n,predictor = False):
+	""" 
+	Solves a time series of operating points in order, seeding each solve
+	with the converged state of the previous row rather than the 
+	initial guesses in Model. 
+
+	With predictor = True, the seed is also corrected to first order in 
+	the change of inputs, reusing the previous row's Jacobian
+		x = x_prev - J_prev^-1 R(x_prev)
+	where R is evaluated with the new inputs
+
+	returns the same array as solveBatch, with nan rows for the operating
+	points that did not converge. The row after one of those starts
+	again from the initial guesses
+
+	>>> heatGen = np.array([0.0005,np.nan,0.001])
+	>>> waterTemp = np.array([20.,21.,22.])
+	>>> import warnings
+	>>> with warnings.catch_warnings():
+	... 	warnings.simplefilter('ignore')
+	... 	(T,B) = (solveSequence(heatGen,waterTemp,6,True),solveBatch(heatGen,waterTemp,6))
+	>>> np.isnan(T[1]).all(), np.allclose(T,B,rtol = 0.,atol = 1e-8,equal_nan = True)
+	(True, True)
+	"""
+	model = compiled(n)
+	ICSolar = model.problem
+	ICSolar.update(model.guess)
+	T = []
+	lu = None
+	for (q,w) in zip(heatGen,waterTemp):
+		ICSolar.setParameters(heatGen = q,waterTemp = w)
+		if lu is not None:
+			x = ICSolar.getSolution()
+			ICSolar.update(x - lu.solve(ICSolar.r(x)))
+		Tw = model.solve(q,w,'newton-sparse',warm = True)
+		if not ICSolar.info['converged']:
+			# nothing to carry on from
+			T.append(np.nan*Tw)
+			ICSolar.update(model.guess)
+			lu = None
+			continue
+		T.append(Tw)
+		if predictor and 'jacobian' in ICSolar.info:
+			lu = spla.splu(sp.csc_matrix(ICSolar.info['jacobian']))
+	return np.array(T)
+
+def solveChunk(chunk):
+	""" 
+	Solves a chunk of rows in a worker, chunk = (heatGen, waterTemp, n) with
+	heatGen and waterTemp as float arrays read from the experiment file,
+	nan where the file has no number
+	The chunk is solved as a batch, and the rows that raise or do not
+	converge in it are solved again on their own, so that a failed row
+	only costs itself
+
+	returns a list with the water temperatures of each row, 
+	or None for rows that failed, or did not converge on their own either
+	"""
+	(heatGen,waterTemp,n) = chunk
+	heatGen = np.asarray(heatGen)/n*1.e-3
+	waterTemp = np.asarray(waterTemp)
+	ok = ~(np.isnan(heatGen) | np.isnan(waterTemp))
+	Ws = [None]*len(heatGen)
+	if not ok.any():
+		return Ws
+	try:
+		for i, Wt in zip(np.flatnonzero(ok),solveBatch(heatGen[ok],waterTemp[ok],n)):
+			if np.isfinite(Wt).all():
+				Ws[i] = list(Wt)
+	except Exception:
+		pass
+	for i in np.flatnonzero(ok):
+		if Ws[i] is not None:
+			continue
+		try:
+			Wt = solve(heatGen[i],waterTemp[i],n)
+			if compiled(n).problem.info['converged'] and np.isfinite(Wt).all():
+				Ws[i] = Wt
+		except Exception:
+			pass
+	return Ws
+
+def replay(infile,outfile,n,workers = None,chunk = 256):
+	""" 
+	Replays an experiment file through the model, streaming it
+	from infile to outfile a chunk of rows at a time (see src/stream.py),
+	so that only a few chunks are ever held in memory. The results are
+	written in input order as they arrive. Rows that fail, by raising
+	or by not converging (see solveChunk), are written with an empty
+	sim_outlet.
+
+	workers is the number of processes, and defaults to the number of cores
+	With workers = 1 the chunks are solved in this process
+
+	returns the number of rows that failed, unconverged ones included
+	"""
+	columns = ['Timestamp','exp_inlet','sim_outlet','exp_outlet','exp_heatgen']
+	csvfile = open(infile,'rb')
+	csvwrite = open(outfile,'w')
+	cw = csv.writer(csvwrite)
+	cw.writerow(columns)
+	failed = [0]
+	def write(text,Ws):
+		text['sim_outlet'] = ['' if Wt is None else round(Wt[-1],8) for Wt in Ws]
+		failed[0] += sum(Wt is None for Wt in Ws)
+		st.write(cw,columns,text)
+		csvwrite.flush()
+
+	chunks = st.chunks(csvfile,['exp_heatgen','exp_inlet'], \
+		['Timestamp','exp_inlet','exp_outlet','exp_heatgen'],chunk)
+	if workers == 1:
+		for (values,text) in chunks:
+			write(text,solveChunk((values['exp_heatgen'],values['exp_inlet'],n)))
+	else:
+		pool = multiprocessing.Pool(workers)
+		# chunks handed to the pool, waiting for their results. Only a
+		# couple per worker are read ahead, so the memory stays bounded
+		pending = deque()
+		window = 2*(workers or multiprocessing.cpu_count())
+		for (values,text) in chunks:
+			pending.append((text,pool.apply_async(solveChunk,((values['exp_heatgen'],values['exp_inlet'],n),))))
+			if len(pending) >= window:
+				(text,result) = pending.popleft()
+				write(text,result.get())
+		while pending:
+			(text,result) = pending.popleft()
+			write(text,result.get())
+		pool.close()
+		pool.join()
+	csvfile.close()
+	csvwrite.close()
+	return failed[0]
+
+# latencies of the last solve requests served, in seconds
+latencies = deque(maxlen = 100000)
+# one lock per compiled Model, as a Model solves one request at a time
+locks = {}
+# the largest module count and batch a request may ask for
+maxModules = 1000
+maxBatch = 4096
+locksLock = threading.Lock()
+
+def lock(key):
+	""" returns the lock of the Model of key, (n, batch) """
+	with locksLock:
+		return locks.setdefault(key,threading.Lock())
+
+def query(heatGen,waterTemp,n):
+	""" 
+	answers a solve request, heatGen and waterTemp are numbers, or lists 
+	for a batch, returns the water temperatures as solve, or solveBatch,
+	and whether they converged, a list of flags for a batch
 	
+	batches are padded up to a power of two rows, by repeating the last,
+	so only a few batch sizes of Model are ever built and kept warm.
+	n and the batch size are bounded by maxModules and maxBatch, and 
+	ValueError is raised outside them
+
+	>>> T, ok = query(0.0005,20.,6)
+	>>> len(T), ok, round(T[-1],6)
+	(13, True, 20.819449)
+	>>> T, ok = query([0.0005,0.001,0.0005],[20.,21.,20.],6)
+	>>> np.round(np.array(T)[:,-1],6), ok
+	(array([20.819449, 22.560635, 20.819449]), [True, True, True])
+	>>> (6, 4) in models
+	True
+	>>> query(0.0005,20.,0)
+	Traceback (most recent call last):
+	...
+	ValueError: n must be from 1 to 1000
+	"""
+	if not 1 <= n <= maxModules:
+		raise ValueError('n must be from 1 to ' + str(maxModules))
+	if np.ndim(heatGen) == 0 and np.ndim(waterTemp) == 0:
+		with lock((n,None)):
+			model = compiled(n)
+			T = model.query(float(heatGen),float(waterTemp))
+			return T.tolist(), bool(model.problem.info['converged'] and np.isfinite(T).all())
+	(heatGen,waterTemp) = np.broadcast_arrays(np.asarray(heatGen,dtype=float),np.asarray(waterTemp,dtype=float))
+	if heatGen.ndim != 1 or not 1 <= len(heatGen) <= maxBatch:
+		raise ValueError('a batch must be a list of 1 to ' + str(maxBatch) + ' numbers')
+	rows = len(heatGen)
+	size = 1 << max(rows-1,0).bit_length()
+	pad = lambda a: np.concatenate([a,np.repeat(a[-1:],size-rows)])
+	with lock((n,size)):
+		model = compiled(n,size)
+		T = model.query(pad(heatGen),pad(waterTemp)).T[:rows]
+		ok = model.problem.info['rows'][:rows] & np.isfinite(T).all(axis=1)
+		return T.tolist(), ok.tolist()
+
+def percentiles():
+	""" the count and the 50, 90, 99 percentiles and maximum of the latencies, in ms """
+	L = np.array(latencies)*1.e3
+	if not len(L):
+		return {'count':0}
+	(p50,p90,p99) = np.percentile(L,[50,90,99])
+	return {'count':len(L),'p50':p50,'p90':p90,'p99':p99,'max':L.max()}
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	"""
+	Handler Class, answers the requests of serve
+
+	POST /solve, with a json body {"heatGen":..., "waterTemp":..., "n":...},
+		returns {"T":..., "ms":...}, the water temperatures and the time taken.
+		A bad request is answered with 400, a solve that did not converge
+		with 422 (and the failed rows of a batch), and any other error with
+		500, each with a json {"error":...}
+	GET /stats, returns the latency percentiles of the solves, see percentiles
+	"""
+	# keep the connection open between requests, and send
+	# the replies without waiting to fill a packet
+	protocol_version = 'HTTP/1.1'
+	disable_nagle_algorithm = True
+
+	def reply(self,code,body):
+		body = json.dumps(body)
+		self.send_response(code)
+		self.send_header('Content-Type','application/json')
+		self.send_header('Content-Length',str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def do_POST(self):
+		if self.path != '/solve':
+			return self.reply(404,{'error':'unknown path ' + self.path})
+		try:
+			request = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length',0))))
+			start = time.time()
+			(T,ok) = query(request['heatGen'],request['waterTemp'],int(request.get('n',6)))
+			latencies.append(time.time() - start)
+		except (ValueError,KeyError,TypeError) as e:
+			return self.reply(400,{'error':repr(e)})
+		except Exception as e:
+			return self.reply(500,{'error':repr(e)})
+		if not np.all(ok):
+			body = {'error':'the solve did not converge'}
+			if isinstance(ok,list):
+				body['rows'] = [i for (i,k) in enumerate(ok) if not k]
+			return self.reply(422,body)
+		self.reply(200,{'T':T,'ms':latencies[-1]*1.e3})
+
+	def do_GET(self):
+		if self.path != '/stats':
+			return self.reply(404,{'error':'unknown path ' + self.path})
+		self.reply(200,percentiles())
+
+	def log_message(self,format,*args):
+		# no log line per request
+		pass
+
+class Server(SocketServer.ThreadingMixIn,BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+"""
+serve:			serves solve requests over HTTP on localhost
+
+input(s):   (port) port to listen on
+						(sizes) module counts to build the Models of before serving
+output(s):	None, serves until interrupted
+
+each request is answered by a thread, from Models kept warm between
+requests (see compiled and Model.query), so a request costs a solve
+of a model already built rather than starting python and building it.
+eg. with python ICSolar.py serve 8642 6
+	curl -d '{"heatGen":0.0005,"waterTemp":20,"n":6}' localhost:8642/solve
+	curl localhost:8642/stats
+"""
+def serve(port = 8642,sizes = []):
+	for n in sizes:
+		query(0.,20.,n)
+	server = Server(('127.0.0.1',port),Handler)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	server.server_close()
+
 if __name__ == "__main__":
-	if len(sys.argv) < 4:
+	if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+		# python ICSolar.py serve [port] [n ...]
+		serve(int(sys.argv[2]) if len(sys.argv) > 2 else 8642,[int(n) for n in sys.argv[3:]])
+	elif len(sys.argv) > 1 and sys.argv[1] == 'replay':
+		# python ICSolar.py replay infile outfile n [workers] [chunk]
+		args = sys.argv[2:]
+		workers = int(args[3]) if len(args) > 3 else None
+		chunk = int(args[4]) if len(args) > 4 else 256
+		print replay(args[0],args[1],int(args[2]),workers,chunk), 'rows failed'
+	elif len(sys.argv) < 4:
 		csvfile = open('Feb11.csv','rU')
 		csvwrite = open('simulation.csv','w')
 		cr = csv.DictReader(csvfile)
@@ -141,21 +606,19 @@ if __name__ == "__main__":
 		Tout = []
 		# TsimA = []
 		numMod = 6
-		TsimW = []
-		AllW =[]
-
+		# skip the empty rows at the end of the file
+		rows = [row for row in cr if row['exp_heatgen']]
 
-		for row in cr:
-			heatGen = float(row['exp_heatgen'])
-			waterTemp = float(row['exp_inlet'])
-			Wt = solve(heatGen/numMod*1.e-3,waterTemp,numMod)
+		heatGen = np.array([float(row['exp_heatgen']) for row in rows])
+		waterTemp = np.array([float(row['exp_inlet']) for row in rows])
+		AllW = solveBatch(heatGen/numMod*1.e-3,waterTemp,numMod)
+		TsimW = AllW[:,-1]
+		for row, Wt in zip(rows,AllW):
 			cw.writerow({'Timestamp':row['Timestamp'],'exp_inlet':row['exp_inlet'], \
 				'exp_outlet':row['exp_outlet'],'sim_outlet':round(Wt[-1],8),'exp_heatgen':row['exp_heatgen']})
-			TsimW.append(Wt[-1])
-			AllW.append(Wt)
 			# TsimA.append(Ta)
 			Tout.append(row['exp_outlet'])
-			Tin.append(waterTemp)
+			Tin.append(float(row['exp_inlet']))
 		csvfile.close()
 		csvwrite.close()
 		i = range(0,len(Tin))
@@ -172,8 +635,8 @@ if __name__ == "__main__":
 		# plt.show()
 		plt.savefig('Feb11.png')
 		plt.close()
-		for j in range(0,len(Wt)):
-			Wj = [w[j] for w in AllW]
+		for j in range(0,AllW.shape[1]):
+			Wj = AllW[:,j]
 			# if (j > 0 and j % 2 == 0):
 			# 	name = 'Module '+str(j/2)
 			# elif ( j == 0 ):
@@ -0,0 +1,134 @@
+"""
+Benchmarks of the model drivers at growing sizes
+
+For every case and size this times
+	construction	building the blocks and the Problem
+	residual		one residual evaluation, r(x)
+	jacobian		one sparse finite difference Jacobian
+						(the best of a few repeats, for both)
+	solve			the full solve, or solveUnst for the transient cases
+and records the peak memory (maximum resident set size, in MB) of the
+process running the case. Each case runs in a fresh worker process,
+so the peak memory of one case does not carry over into the next.
+
+Run as
+python benchmark.py [results.json] [baseline.json] [tolerance]
+
+The baseline defaults to results/benchmark.json, the stored results
+of an earlier run, when it exists.
+
+The results are written as json, a list of records
+	{'case':..., 'size':..., 'construction':..., 'residual':...,
+	'jacobian':..., 'solve':..., 'memory':...}
+(times in seconds). Given a baseline (an earlier results file), every
+time and memory more than tolerance (default 2) times its baseline
+value is reported as a regression, and the exit status is 1.
+Timings on a shared machine easily vary by 50%, hence the default.
+"""
+import json
+import sys
+import time
+import resource
+import os
+import multiprocessing
+import poisson2D
+import diffusion2D
+import ICSolarSimple
+import ICSolar
+
+# pairs of (build, solve), build(size) returns the Problem,
+# and solve(P) solves it
+cases = {
+	'poisson2D':(poisson2D.poisson2DProblem,lambda P: P.solve('newton-sparse')),
+	'poisson2DGrid':(poisson2D.poisson2DGridProblem,lambda P: P.solve('newton-sparse')),
+	'diffusion2D':(diffusion2D.diff2DProblem,lambda P: P.solveUnst(0,1,10)),
+	'diffusion2DGrid':(diffusion2D.diff2DGridProblem,lambda P: P.solveUnst(0,1,10,method = 'BDF')),
+	'ICSolarSimple':(lambda n: ICSolarSimple.problem(),lambda P: P.solve()),
+	'ICSolar':(lambda n: ICSolar.Model(n).problem, \
+		lambda P: (P.setParameters(heatGen = 0.0005,waterTemp = 20.),P.solve('fsolve'))),
+}
+
+# sizes of each case, N cells across for the 2-D problems,
+# and the number of modules for ICSolar
+sizes = [
+	('poisson2D',[8,16,32]),
+	('poisson2DGrid',[32,64,128,256]),
+	('diffusion2D',[4,8]),
+	('diffusion2DGrid',[16,32,64]),
+	('ICSolarSimple',[1]),
+	('ICSolar',[1,6,12,24]),
+]
+
+metrics = ['construction','residual','jacobian','solve','memory']
+
+def timed(f,repeat = 1):
+	""" returns the shortest wall time of repeat calls of f """
+	best = float('inf')
+	for i in range(repeat):
+		start = time.time()
+		f()
+		best = min(best,time.time() - start)
+	return best
+
+def run(case,size):
+	"""
+	runs one case at one size, returns its record
+	"""
+	(build,solve) = cases[case]
+	record = {'case':case,'size':size}
+	start = time.time()
+	P = build(size)
+	record['construction'] = time.time() - start
+	x = P.getSolution()
+	record['residual'] = timed(lambda: P.r(x),10)
+	record['jacobian'] = timed(lambda: P.jacobian(x),3)
+	record['solve'] = timed(lambda: solve(P))
+	# ru_maxrss is in kB on Linux
+	record['memory'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.
+	return record
+
+def benchmark(sizes = sizes):
+	""" runs every case, each in a new process, returns the list of records """
+	records = []
+	for (case,N) in sizes:
+		for size in N:
+			pool = multiprocessing.Pool(1)
+			records.append(pool.apply(run,(case,size)))
+			pool.close()
+			pool.join()
+			print '%(case)16s %(size)5d  construction %(construction)8.4f  residual %(residual)8.5f' \
+				'  jacobian %(jacobian)8.4f  solve %(solve)8.3f  memory %(memory)7.1f' % records[-1]
+	return records
+
+def compare(records,baseline,tolerance = 2.):
+	"""
+	returns the regressions, (case, size, metric, value, baseline value),
+	for every metric more than tolerance times its baseline
+	"""
+	old = dict(((r['case'],r['size']),r) for r in baseline)
+	regressions = []
+	for r in records:
+		if (r['case'],r['size']) not in old:
+			continue
+		for m in metrics:
+			b = old[(r['case'],r['size'])].get(m)
+			# ignore times too short to measure reliably
+			if b is not None and r[m] > tolerance*b and r[m] > 1e-2:
+				regressions.append((r['case'],r['size'],m,r[m],b))
+	return regressions
+
+if __name__ == "__main__":
+	outfile = sys.argv[1] if len(sys.argv) > 1 else 'benchmark.json'
+	records = benchmark()
+	with open(outfile,'w') as out:
+		json.dump(records,out,indent = 1,sort_keys = True)
+	basefile = sys.argv[2] if len(sys.argv) > 2 else 'results/benchmark.json'
+	if os.path.exists(basefile):
+		with open(basefile) as base:
+			baseline = json.load(base)
+		tolerance = float(sys.argv[3]) if len(sys.argv) > 3 else 2.
+		regressions = compare(records,baseline,tolerance)
+		for r in regressions:
+			print 'regression: %s %d %s %.4g (baseline %.4g)' % r
+		if regressions:
+			sys.exit(1)
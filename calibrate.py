@@ -0,0 +1,132 @@
+"""
+Calibration of the ICSolar model against measured outlet temperatures
+
+Fits declared parameters of the ICSolar Model (by default the
+heatCondSimple film coefficients hExt, hInt and hWa) to the measured
+water outlet temperatures (exp_outlet) of a data file such as Feb11.csv,
+by nonlinear least squares (scipy.optimize.least_squares)
+	min sum over rows (sim_outlet - exp_outlet)^2
+
+Every evaluation of the objective simulates all the rows. The rows are
+split into chunks, each solved as one batch (see ICSolar.solveBatch)
+in a pool of worker processes, which keep their compiled Models between
+evaluations, so only the parameter values are sent to them. The
+derivatives of the outlet temperatures are found along with them, from
+the converged Jacobian (see Problem.sensitivities), rather than by
+solving again for perturbed parameters.
+
+Run as
+python calibrate.py data.csv [n] [workers] [parameters...]
+eg. python calibrate.py Feb11.csv 6 4 hExt hInt hWa
+
+The fitted values are printed and written to calibration.json, and are
+used by setting them on a Model, eg.
+	ICSolar.compiled(6).problem.setParameters(**fitted)
+"""
+import csv
+import json
+import sys
+import multiprocessing
+import numpy as np
+from scipy.optimize import least_squares
+import ICSolar
+
+def read(filename):
+	"""
+	reads the rows of a data file with a heat generation and outlet temperature,
+	returns the arrays (exp_heatgen, exp_inlet, exp_outlet)
+	"""
+	with open(filename,'rU') as csvfile:
+		rows = [row for row in csv.DictReader(csvfile) if row['exp_heatgen'] and row['exp_outlet']]
+	return tuple(np.array([float(row[k]) for row in rows]) \
+		for k in ['exp_heatgen','exp_inlet','exp_outlet'])
+
+def outlets(job):
+	"""
+	solves a chunk of rows as one batch in a worker, job = (n, values, heatGen, waterTemp, names),
+	returns the outlet temperatures, and their derivatives with respect to names in the next columns.
+	The outlets of operating points that did not converge are nan (see ICSolar.solveBatch), and
+	so are all the derivatives then, as the Jacobian of the batch is no longer of any use
+	"""
+	(n,values,heatGen,waterTemp,names) = job
+	model = ICSolar.compiled(n,len(heatGen))
+	model.problem.setParameters(**values)
+	T = model.solve(heatGen,waterTemp,'newton-sparse')[-1]
+	rows = model.problem.info['rows']
+	T[~rows] = np.nan
+	if not names:
+		return T[:,None]
+	if not rows.all():
+		return np.column_stack([T,np.nan*np.ones((len(T),len(names)))])
+	return np.column_stack([T,model.sensitivities(names)])
+
+"""
+calibrate:		fits Model parameters to measured outlet temperatures
+
+input(s):   (heatGen) measured total heat generation of each row, W
+						(waterTemp) inlet water temperature of each row
+						(outlet) measured outlet water temperature of each row
+						(n) number of modules
+						(names) names of the declared parameters to fit
+						(workers) number of worker processes
+						(chunk) rows per batch solve
+						(gradient) use the sensitivities as the Jacobian, or
+							finite differences of the objective if False
+						(options) passed to least_squares
+output(s):	(values) dict of the fitted parameters
+						(result) the least_squares result, with the outlet
+							residuals in .fun
+
+raises RuntimeError if a row does not converge at the parameters
+least_squares asks for, rather than fitting to unconverged outlets
+"""
+def calibrate(heatGen,waterTemp,outlet,n,names = ['hExt','hInt','hWa'],workers = None,chunk = 256, \
+	gradient = True,**options):
+	# heat generation per module, in kW as in ICSolar
+	heatGen = np.asarray(heatGen,dtype=float)/n*1.e-3
+	waterTemp = np.asarray(waterTemp,dtype=float)
+	outlet = np.asarray(outlet,dtype=float)
+	starts = range(0,len(outlet),chunk)
+	pool = multiprocessing.Pool(workers or multiprocessing.cpu_count())
+	# the outlets and their derivatives at the last parameters,
+	# as least_squares asks for the Jacobian at the point just evaluated
+	last = {}
+	def evaluate(p):
+		if 'p' not in last or not np.array_equal(last['p'],p):
+			values = dict(zip(names,p))
+			jobs = [(n,values,heatGen[i:i+chunk],waterTemp[i:i+chunk],names if gradient else []) \
+				for i in starts]
+			Y = np.concatenate(pool.map(outlets,jobs))
+			failed = np.isnan(Y[:,0])
+			if failed.any():
+				raise RuntimeError(str(failed.sum()) + ' rows did not converge at ' + str(values))
+			last.update(p = np.copy(p),f = Y[:,0] - outlet,J = Y[:,1:])
+		return last
+	model = ICSolar.compiled(n)
+	p0 = np.array([model.problem.getParameter(name) for name in names],dtype=float)
+	if gradient:
+		options.setdefault('jac',lambda p: evaluate(p)['J'])
+	else:
+		# the solves are converged to about 1e-8, so the finite difference
+		# steps have to be well above that
+		options.setdefault('diff_step',1e-4)
+	options.setdefault('bounds',(0.,np.inf))
+	options.setdefault('x_scale','jac')
+	try:
+		result = least_squares(lambda p: evaluate(p)['f'],p0,**options)
+	finally:
+		pool.close()
+		pool.join()
+	return dict(zip(names,result.x.tolist())), result
+
+if __name__ == "__main__":
+	(heatGen,waterTemp,outlet) = read(sys.argv[1])
+	n = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+	workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+	names = sys.argv[4:] or ['hExt','hInt','hWa']
+	(values,result) = calibrate(heatGen,waterTemp,outlet,n,names,workers,verbose = 1)
+	for name in names:
+		print '%6s %.10g' % (name,values[name])
+	print 'rms outlet error %.4f C over %d rows' % (np.sqrt(np.mean(result.fun**2)),len(outlet))
+	with open('calibration.json','w') as out:
+		json.dump(values,out,indent = 1,sort_keys = True)
@@ -0,0 +1,98 @@
+"""
+Convergence studies of the 2-D test problems
+
+Runs a ladder of resolutions N, 2N, 4N, ... of poisson2D.py or
+diffusion2D.py in parallel worker processes, and reports the
+observed order of accuracy between each pair of resolutions,
+	p = log(E_N/E_2N)/log(2)
+and the Richardson extrapolation of the errors from the last three
+resolutions,
+	E_inf = E_4N + (E_4N - E_2N)/(2^p - 1),  p = log((E_N - E_2N)/(E_2N - E_4N))/log(2)
+which should be near zero when the ladder is in the asymptotic range.
+
+Each resolution's errors are cached on disk (convergence.json), keyed
+by the problem, its parameters and N, so rerunning a study only
+solves the resolutions that are new.
+
+Run as
+python convergence.py problem N levels [workers] [method]
+eg. python convergence.py poisson2DGrid 8 5
+where problem is poisson2D, poisson2DGrid, diffusion2D or diffusion2DGrid,
+and method is the solveUnst method for diffusion2DGrid
+"""
+import json
+import math
+import os
+import sys
+import multiprocessing
+import poisson2D
+import diffusion2D
+
+# functions of (N, parameters) returning the errors in (u, v)
+problems = {
+	'poisson2D':lambda N: poisson2D.poisson2D(N),
+	'poisson2DGrid':lambda N: poisson2D.poisson2DGrid(N),
+	'diffusion2D':lambda N: diffusion2D.diff2D(N),
+	'diffusion2DGrid':lambda N,method = 'lsoda': diffusion2D.diff2DGrid(N,method),
+}
+
+def key(problem,N,parameters):
+	""" cache key of one resolution """
+	return '%s(%d%s)' % (problem,N,''.join(',%s=%r' % kv for kv in sorted(parameters.items())))
+
+def errors(job):
+	""" solves one resolution in a worker, job = (problem, N, parameters) """
+	(problem,N,parameters) = job
+	return list(problems[problem](N,**parameters))
+
+def study(problem,N,levels,workers = None,cache = 'convergence.json',**parameters):
+	"""
+	runs the resolutions N*2^k, k < levels, that are not in the cache
+
+	returns (sizes, E, orders, limits), E[k] being the errors at sizes[k],
+	orders[k] the observed orders between sizes[k] and sizes[k+1],
+	and limits the Richardson extrapolated errors (None with fewer than 3 levels)
+	"""
+	sizes = [N*2**k for k in range(levels)]
+	known = {}
+	if cache and os.path.exists(cache):
+		with open(cache) as f:
+			known = json.load(f)
+	jobs = [(problem,n,parameters) for n in sizes if key(problem,n,parameters) not in known]
+	if jobs:
+		pool = multiprocessing.Pool(min(workers or multiprocessing.cpu_count(),len(jobs)))
+		for job, E in zip(jobs,pool.map(errors,jobs)):
+			known[key(*job)] = E
+		pool.close()
+		pool.join()
+		if cache:
+			with open(cache,'w') as f:
+				json.dump(known,f,indent = 1,sort_keys = True)
+	E = [known[key(problem,n,parameters)] for n in sizes]
+	orders = [[math.log(c/f)/math.log(2.) for c,f in zip(E[k],E[k+1])] for k in range(levels-1)]
+	limits = None
+	if levels > 2:
+		limits = []
+		for (e1,e2,e3) in zip(*E[-3:]):
+			try:
+				p = math.log((e1-e2)/(e2-e3))/math.log(2.)
+				limits.append(e3 + (e3-e2)/(2.**p-1.))
+			except (ValueError,ZeroDivisionError):
+				# not monotone, no order to extrapolate with
+				limits.append(float('nan'))
+	return sizes, E, orders, limits
+
+if __name__ == "__main__":
+	problem = sys.argv[1]
+	N = int(sys.argv[2])
+	levels = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+	workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+	parameters = {'method':sys.argv[5]} if len(sys.argv) > 5 else {}
+	(sizes,E,orders,limits) = study(problem,N,levels,workers,**parameters)
+	for k, n in enumerate(sizes):
+		print '%6d  errors %s' % (n,' '.join('%.4e' % e for e in E[k])),
+		if k > 0:
+			print ' order %s' % ' '.join('%.3f' % p for p in orders[k-1]),
+		print
+	if limits is not None:
+		print 'Richardson extrapolated errors', ' '.join('%.4e' % e for e in limits)
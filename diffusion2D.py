@@ -16,24 +16,69 @@ and tf = 1
 python diffusion2Dunsteady.py n
 for the number of cells in each dimension
 
-Run this problem as python poisson2D.py N
-where N is the number of cells. The code does a rough accuracy estimation,
-and outputs the accuracy for both u and v. The accuracy should be around 2 if 
-the code is performing correctly.
+Run this problem as python diffusion2D.py N
+where N is the number of cells. The code prints the RMS errors in u and v
+at N and 2N, and the rates between them. These are not orders of
+accuracy: the interior starts from zero rather than the exact solution,
+the difference stencil has unit diffusivity for both u and v (nu_v is
+not applied), and by tf = 1 the exact solutions have decayed to about
+3e-9 (u) and 5e-5 (v). The errors mostly measure how far the start has
+decayed. With the boundary states at their own coordinates, the block and
+grid versions agree, and print
+	N = 4:   errors (4.26e-6, 9.56e-5) and (1.21e-7, 4.35e-5), rates [5.14, 1.14]
+	N = 10:  rates [2.58, 0.30] (blocks) and [2.50, 0.30] (grid)
 
+Run this problem as python diffusion2D.py N grid
+to solve it on a structured grid (src/grid.py) rather than with
+individual blocks and fluxes.
+
+convergence.py runs longer ladders of resolutions of this problem
+in parallel, caching the errors of each resolution on disk.
+
+Run this problem as python diffusion2D.py N grid BDF
+to march the grid with the implicit BDF (or Radau) method and the
+sparse Jacobian, which is much faster on fine grids as the problem is stiff
+
+------------------------------------
+function tests are run by doctest
+python -m doctest diffusion2D.py
+------------------------------------
+>>> P = diff2DProblem(4)
+>>> P.update(P.getSolution(),0.5)
+>>> (x,y) = np.array([bb.position for bb in P.bc]).T
+>>> u = np.array([bb.state['u'] for bb in P.bc])
+>>> np.abs(u - math.exp(-2*math.pi**2*0.5)*np.sin(math.pi*x)*np.sin(math.pi*y)).max() < 1e-15
+True
+>>> np.round(diff2D(4),8)
+array([4.260e-06, 9.555e-05])
+>>> np.abs(np.array(diff2D(4)) - diff2DGrid(4)).max() < 1e-12
+True
+>>> P = diff2DGridProblem(4)
+>>> P.solveUnst(0,1,10,rtol = 1e-10,atol = 1e-12)
+>>> Q = diff2DGridProblem(4)
+>>> Q.solveUnst(0,1,10,method = 'BDF',rtol = 1e-10,atol = 1e-12)
+>>> np.abs(Q.getSolution() - P.getSolution()).max() < 1e-10
+True
+>>> Q = diff2DGridProblem(4)
+>>> Q.solveUnst(0,1,10,method = 'BDF')
+>>> 1e-9 < np.abs(Q.getSolution() - P.getSolution()).max() < 1e-7
+True
 """
 import math as math
 import sys
+import numpy as np
 import src.blocks as b
 import src.flux as f
+import src.grid as g
 import src.problem as p
 import src.source as s
 
-def diff2D(N):
+def diff2DProblem(N):
 	""" 
 	lets define a uniform square mesh on [-1, 1] x [1, 1]
 	and create boundary blocks as we go,
 	initializing based on the exact solution, and naming the block by its coordinates
+	returns the Problem on the interior blocks
 	"""
 	u_a = 1
 	u_b = 1
@@ -48,6 +93,9 @@ def diff2D(N):
 		u = math.sin(u_a*math.pi*(i*d-d/2-1))*math.sin(u_b*math.pi*(j*d-d/2-1)),
 		v = math.sin(v_a*math.pi*(i*d-d/2-1))*math.sin(v_b*math.pi*(j*d-d/2-1))) \
 		for i in range(0,N+2) for j in range(0,N+2)]
+	for i in range(0,N+2):
+		for j in range(0,N+2):
+			B[i*(N+2)+j].position = (i*d-d/2-1,j*d-d/2-1)
 
 	# Flux geometry	
 	G = {'type':'edge','d':d*d,'m':[]}
@@ -61,46 +109,120 @@ def diff2D(N):
 			B[i*n+j].state['v'] = 0.
 
 	interiorBlocks = [B[i*n+j] for i in range(1,n-1) for j in range(1,n-1)]
-	boundaryBlocks = []
 	bcRange = [j         for j in range(1,n-1)] + \
 						[(n-1)*n+j for j in range(1,n-1)] + \
 						[i*n       for i in range(0,n)] + \
 						[i*n+n-1   for i in range(0,n)] 
 
-	for k in bcRange:
-		(x,y) = eval(B[k].name)
-		B[k].addSource(s.Source('time', \
-			u = lambda t: math.exp(-nu_u*math.pi*math.pi*(u_a*u_a+u_b*u_b)*t)*math.sin(u_a*math.pi*x)*math.sin(u_b*math.pi*y), \
-			v = lambda t: math.exp(-nu_v*math.pi*math.pi*(v_a*v_a+v_b*v_b)*t)*math.sin(v_a*math.pi*x)*math.sin(v_b*math.pi*y)))
-		boundaryBlocks.append(B[k])
+	boundaryBlocks = [B[k] for k in bcRange]
 
 	# solve the problem on the interior blocks
-	P = p.Problem(interiorBlocks,boundaryBlocks)
+	P = p.Problem(interiorBlocks,boundaryBlocks,array = True)
+	# drive all the boundary states at once, from the block coordinates
+	(x,y) = np.array([boundaryBlocks[i].position for (i,k) in P.bcmapping]).T
+	isU = np.array([k == 'u' for (i,k) in P.bcmapping])
+	P.drive(lambda t: np.where(isU, \
+		math.exp(-nu_u*math.pi*math.pi*(u_a*u_a+u_b*u_b)*t)*np.sin(u_a*math.pi*x)*np.sin(u_b*math.pi*y), \
+		math.exp(-nu_v*math.pi*math.pi*(v_a*v_a+v_b*v_b)*t)*np.sin(v_a*math.pi*x)*np.sin(v_b*math.pi*y)))
+	return P
+
+def diff2D(N):
+	""" solves the problem on N x N blocks, returns the errors in u and v """
+	u_a = 1
+	u_b = 1
+	nu_u = 1
+	v_a = 1
+	v_b = 1
+	nu_v = 0.5
+	tf = 1
+	P = diff2DProblem(N)
+	interiorBlocks = P.b
+	n = N+2
 	P.solveUnst(0,tf,10)
 	# P.printSolution()
-	Eu = 0
-	Ev = 0
 	t = tf
-	for bb in interiorBlocks:
-		(x,y) = eval(bb.name)
-		ue = math.exp(-nu_u*math.pi*math.pi*(u_a*u_a+u_b*u_b)*t)*math.sin(u_a*math.pi*x)*math.sin(u_b*math.pi*y)
-		ve = math.exp(-nu_v*math.pi*math.pi*(v_a*v_a+v_b*v_b)*t)*math.sin(v_a*math.pi*x)*math.sin(v_b*math.pi*y)
-		Eu += (bb.state['u']-ue)**2
-		Ev += (bb.state['v']-ve)**2
+	(x,y) = np.array([bb.position for bb in interiorBlocks]).T
+	ue = math.exp(-nu_u*math.pi*math.pi*(u_a*u_a+u_b*u_b)*t)*np.sin(u_a*math.pi*x)*np.sin(u_b*math.pi*y)
+	ve = math.exp(-nu_v*math.pi*math.pi*(v_a*v_a+v_b*v_b)*t)*np.sin(v_a*math.pi*x)*np.sin(v_b*math.pi*y)
+	Eu = np.sum((np.array([bb.state['u'] for bb in interiorBlocks])-ue)**2)
+	Ev = np.sum((np.array([bb.state['v'] for bb in interiorBlocks])-ve)**2)
 
 	# Eu = math.sqrt(sum([(math.exp(-nu_u*math.pi*math.pi*(u_a*u_a+u_b*u_b)*tf)*math.sin(u_a*math.pi*block.name[0])*math.sin(u_b*math.pi*block.name[1]) \
 	# 	-block.state['u'])**2 for block in interiorBlocks])/(n-2)/(n-2))
 	# Ev = math.sqrt(sum([(math.exp(-nu_v*math.pi*math.pi*(v_a*v_a+v_b*v_b)*tf)*math.sin(v_a*math.pi*block.name[0])*math.sin(v_b*math.pi*block.name[1]) \
 		# -block.state['v'])**2 for block in interiorBlocks])/(n-2)/(n-2))
-	return (math.sqrt(Eu/(n-2)/(n-2)),math.sqrt(Ev)/(n-2)/(n-2))
+	return (math.sqrt(Eu/(n-2)/(n-2)),math.sqrt(Ev/(n-2)/(n-2)))
+
+def diff2DGridProblem(N):
+	""" 
+	the same problem on a structured grid, where the states are 
+	(N+2) x (N+2) arrays, the outer layer being the boundary blocks,
+	driven in time through the ghost cells
+	returns the Problem on the interior of the grid
+	"""
+	u_a = 1
+	u_b = 1
+	nu_u = 1
+	v_a = 1
+	v_b = 1
+	nu_v = 0.5
+	tf = 1
+	d = 2./float(N) # spacing, delta 
+	x = [i*d-d/2-1 for i in range(0,N+2)]
+	(X,Y) = np.meshgrid(x,x,indexing='ij')
+	# initialize with exact solution at t = 0
+	u = np.sin(u_a*math.pi*X)*np.sin(u_b*math.pi*Y)
+	v = np.sin(v_a*math.pi*X)*np.sin(v_b*math.pi*Y)
+	u[1:-1,1:-1] = 0.
+	v[1:-1,1:-1] = 0.
+	G = {'type':'edge','d':d*d,'m':[]}
+	grid = g.Grid('grid',G,u = u,v = v)
+	grid.position = (X[1:-1,1:-1],Y[1:-1,1:-1])
+	(x,y) = (X[grid.ring],Y[grid.ring])
+	grid.addBoundary(s.Source('time', \
+		u = lambda t: math.exp(-nu_u*math.pi*math.pi*(u_a*u_a+u_b*u_b)*t)*np.sin(u_a*math.pi*x)*np.sin(u_b*math.pi*y), \
+		v = lambda t: math.exp(-nu_v*math.pi*math.pi*(v_a*v_a+v_b*v_b)*t)*np.sin(v_a*math.pi*x)*np.sin(v_b*math.pi*y)))
+
+	return p.Problem([grid])
+
+def diff2DGrid(N,method = 'lsoda'):
+	""" 
+	solves the problem on an N x N grid with the solveUnst method,
+	returns the errors in u and v
+	"""
+	u_a = 1
+	u_b = 1
+	nu_u = 1
+	v_a = 1
+	v_b = 1
+	nu_v = 0.5
+	tf = 1
+	d = 2./float(N) # spacing, delta 
+	x = [i*d-d/2-1 for i in range(0,N+2)]
+	(X,Y) = np.meshgrid(x,x,indexing='ij')
+	# solve the problem on the interior of the grid
+	P = diff2DGridProblem(N)
+	grid = P.b[0]
+	P.solveUnst(0,tf,10,method = method)
+	t = tf
+	(X,Y) = (X[1:-1,1:-1],Y[1:-1,1:-1])
+	ue = math.exp(-nu_u*math.pi*math.pi*(u_a*u_a+u_b*u_b)*t)*np.sin(u_a*math.pi*X)*np.sin(u_b*math.pi*Y)
+	ve = math.exp(-nu_v*math.pi*math.pi*(v_a*v_a+v_b*v_b)*t)*np.sin(v_a*math.pi*X)*np.sin(v_b*math.pi*Y)
+	Eu = np.sum((grid.state['u'][1:-1,1:-1]-ue)**2)
+	Ev = np.sum((grid.state['v'][1:-1,1:-1]-ve)**2)
+	return (math.sqrt(Eu/N/N),math.sqrt(Ev/N/N))
 
 if __name__ == "__main__":
 	if len(sys.argv) < 2:
 		n = 10
 	else:
 		n = int(sys.argv[1])
+	if len(sys.argv) > 2 and sys.argv[2] == 'grid':
+		method = sys.argv[3] if len(sys.argv) > 3 else 'lsoda'
+		diff2D = lambda n: diff2DGrid(n,method)
 	# diff2D(n)
 	Error = [diff2D(n),diff2D(n*2)]
 	Rate = [(math.log(Error[1][0])-math.log(Error[0][0]))/(math.log(2./(2*n))-math.log(2./(n))),
 	(math.log(Error[1][1])-math.log(Error[0][1]))/(math.log(2./(2*n))-math.log(2./(n)))]
+	print Error
 	print Rate
\ No newline at end of file
@@ -15,28 +15,46 @@ where N is the number of cells. The code does a rough accuracy estimation,
 and outputs the accuracy for both u and v. The accuracy should be around 2 if 
 the code is performing correctly.
 
+Run this problem as python poisson2D.py N grid
+to solve it on a structured grid (src/grid.py) rather than with
+individual blocks and fluxes.
+
+Run this problem as python poisson2D.py N grid newton-multigrid
+to solve the grid with multigrid (src/multigrid.py), which scales
+linearly with the number of cells.
+
+convergence.py runs longer ladders of resolutions of this problem
+in parallel, caching the errors of each resolution on disk.
+
 """
 import math as math
 import sys
+import numpy as np
 import src.blocks as b
 import src.flux as f
+import src.grid as g
 import src.problem as p
 import src.source as s
 
-def poisson2D(N):
+def poisson2DProblem(N):
 	""" 
 	lets define a uniform square mesh on [-1, 1] x [1, 1]
 	and create boundary blocks as we go,
 	initializing based on the exact solution, and naming the block by its coordinates
+	which are also kept as the block's position
+	returns the Problem on the interior blocks
 	"""
 	d = 2./float(N) # spacing, delta X
 	B = [b.Block('('+str(i*d-d/2-1)+','+str(j*d-d/2-1)+')',None,u = math.exp((i*d-d/2-1)*(j*d-d/2-1)),
 		v = math.exp((i*d-d/2-1)**2+(j*d-d/2-1)**2)) for i in range(0,N+2) for j in range(0,N+2)]
+	for i in range(0,N+2):
+		for j in range(0,N+2):
+			B[i*(N+2)+j].position = (i*d-d/2-1,j*d-d/2-1)
 
 	# interior sources
-	# use the name to get the source values
+	# use the position to get the source values
 	for block in B:
-		(x,y) = eval(block.name)
+		(x,y) = block.position
 		block.addSource(s.Source('const',u = -(x*x+y*y)*math.exp(x*y),v = -4.0*(x*x+y*y+1.0)*math.exp(x*x+y*y)))
 	# Flux geometry	
 	G = {'type':'edge','d':d*d,'m':[]}
@@ -49,12 +67,55 @@ def poisson2D(N):
 			B[i*n+j].state['u'] = 0.
 			B[i*n+j].state['v'] = 0.
 	interiorBlocks = [B[i*n+j] for i in range(1,n-1) for j in range(1,n-1)]
+	return p.Problem(interiorBlocks,array = True)
 
+def poisson2D(N):
+	""" solves the problem on N x N blocks, returns the errors in u and v """
+	n = N+2
 	# solve the problem on the interior blocks
-	P = p.Problem(interiorBlocks)
-	P.solve()
-	Eu = math.sqrt(sum([(math.exp(eval(block.name)[0]*eval(block.name)[1])-block.state['u'])**2 for block in interiorBlocks])/(n-2)/(n-2))
-	Ev = math.sqrt(sum([(math.exp(eval(block.name)[0]**2+eval(block.name)[1]**2)-block.state['v'])**2 for block in interiorBlocks])/(n-2)/(n-2))
+	P = poisson2DProblem(N)
+	P.solve('newton-sparse')
+	(X,Y) = np.array([block.position for block in P.b]).T
+	U = np.array([block.state['u'] for block in P.b])
+	V = np.array([block.state['v'] for block in P.b])
+	Eu = math.sqrt(np.sum((np.exp(X*Y)-U)**2)/(n-2)/(n-2))
+	Ev = math.sqrt(np.sum((np.exp(X*X+Y*Y)-V)**2)/(n-2)/(n-2))
+	return (Eu,Ev)
+
+def poisson2DGridProblem(N):
+	""" 
+	the same problem on a structured grid, where the states are 
+	(N+2) x (N+2) arrays, the outer layer being the boundary blocks
+	returns the Problem on the interior of the grid
+	"""
+	d = 2./float(N) # spacing, delta X
+	x = [i*d-d/2-1 for i in range(0,N+2)]
+	(X,Y) = np.meshgrid(x,x,indexing='ij')
+	u = np.exp(X*Y)
+	v = np.exp(X*X+Y*Y)
+	u[1:-1,1:-1] = 0.
+	v[1:-1,1:-1] = 0.
+	G = {'type':'edge','d':d*d,'m':[]}
+	grid = g.Grid('grid',G,u = u,v = v)
+	(X,Y) = (X[1:-1,1:-1],Y[1:-1,1:-1])
+	grid.position = (X,Y)
+	grid.addSource(s.Source('const',u = -(X*X+Y*Y)*np.exp(X*Y),v = -4.0*(X*X+Y*Y+1.0)*np.exp(X*X+Y*Y)))
+	return p.Problem([grid])
+
+def poisson2DGrid(N,method = 'newton-sparse'):
+	""" 
+	solves the problem on an N x N grid with the Problem.solve method,
+	returns the errors in u and v
+	"""
+	d = 2./float(N) # spacing, delta X
+	x = [i*d-d/2-1 for i in range(1,N+1)]
+	(X,Y) = np.meshgrid(x,x,indexing='ij')
+	# solve the problem on the interior of the grid
+	P = poisson2DGridProblem(N)
+	P.solve(method)
+	grid = P.b[0]
+	Eu = math.sqrt(np.mean((np.exp(X*Y)-grid.state['u'][1:-1,1:-1])**2))
+	Ev = math.sqrt(np.mean((np.exp(X*X+Y*Y)-grid.state['v'][1:-1,1:-1])**2))
 	return (Eu,Ev)
 
 if __name__ == "__main__":
@@ -62,6 +123,9 @@ if __name__ == "__main__":
 		n = 10
 	else:
 		n = int(sys.argv[1])
+	if len(sys.argv) > 2 and sys.argv[2] == 'grid':
+		method = sys.argv[3] if len(sys.argv) > 3 else 'newton-sparse'
+		poisson2D = lambda n: poisson2DGrid(n,method)
 	Error = [poisson2D(n),poisson2D(n*2)]
 	Rate = [(math.log(Error[1][0])-math.log(Error[0][0]))/(math.log(2./(2*n))-math.log(2./(n))),
 	(math.log(Error[1][1])-math.log(Error[0][1]))/(math.log(2./(2*n))-math.log(2./(n)))]
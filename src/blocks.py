@@ -10,6 +10,8 @@ Each Block has:
 		Sources and Fluxes do not need to be ordered 
 		since they are never explicitly globally unwrapped
 	(.p) dictionary of parameters (time, space, etc)
+	(.position) optional coordinates of the block, a tuple of floats,
+		used by the Problem's spatial index (see Problem.locate)
 
 The equation for the block is
 R(state) = Sum(Fluxes(state)) + Sum(Sources(state)) = 0
@@ -29,6 +31,93 @@ import numpy as np
 from collections import OrderedDict
 from math import log, pi
 
+class State(object):
+	"""
+	State Class
+
+	an OrderedDict-like view of a block's states into a global array,
+	used by Problem when it is array-backed. Reads and writes go straight
+	to the global array, so the Problem never has to copy states
+	into or out of the blocks.
+
+	__init__:		State Constructor
+
+	input(s):   (keys) ordered state names
+							(x) global array of floats
+							(offset) index of the first state in x
+	output(s):	None
+
+	>>> x = np.array([1.,2.,3.])
+	>>> S = State(['u','v'],x,1)
+	>>> S['v']
+	3.0
+	>>> S['u'] = 5.
+	>>> x
+	array([1., 5., 3.])
+	>>> S.keys()
+	['u', 'v']
+	"""
+	def __init__(self,keys,x,offset):
+		self.x = x
+		self.offset = offset
+		self.names = list(keys)
+		self.index = dict((k,offset+i) for i,k in enumerate(self.names))
+
+	def __getitem__(self,k):
+		return self.x.item(self.index[k])
+
+	def __setitem__(self,k,v):
+		self.x[self.index[k]] = v
+
+	def __iter__(self):
+		return iter(self.names)
+
+	def __len__(self):
+		return len(self.names)
+
+	def __contains__(self,k):
+		return k in self.index
+
+	def keys(self):
+		return list(self.names)
+
+	def values(self):
+		return [self.x.item(self.index[k]) for k in self.names]
+
+	def items(self):
+		return [(k,self.x.item(self.index[k])) for k in self.names]
+
+	def iteritems(self):
+		return iter(self.items())
+
+	def get(self,k,d = None):
+		return self[k] if k in self.index else d
+
+	def __repr__(self):
+		return 'State(' + repr(self.items()) + ')'
+
+class BatchState(State):
+	"""
+	BatchState Class
+
+	a State where x has one row per state and one column
+	per operating point, so each state is an array view
+
+	>>> x = np.zeros((2,3))
+	>>> S = BatchState(['u','v'],x,0)
+	>>> S['v'] = [1.,2.,3.]
+	>>> S['v']*2
+	array([2., 4., 6.])
+	"""
+	def __getitem__(self,k):
+		return self.x[self.index[k]]
+
+	def values(self):
+		return [self.x[self.index[k]] for k in self.names]
+
+	def items(self):
+		return [(k,self.x[self.index[k]]) for k in self.names]
+
 class Block(object):
 	""" 
 	Block Class
@@ -65,10 +154,41 @@ class Block(object):
 	def addFlux(self,F):
 		self.F.append(F)
 		F.B = self
+		F.setup()
 
 	def addSource(self,S):
 		self.S.append(S)
 
+	"""
+	labels: the labels of the states to solve for,
+		which the Problem uses for its mapping
+
+	input(s):  None
+	output(s): list of state names
+	"""
+	def labels(self):
+		return self.state.keys()
+
+	"""
+	bind: Array Setup Function
+
+	input(s):  (x) global array of floats
+						 (offset) index of this block's first state in x
+	output(s): None
+
+	copies the current states into x, then replaces
+	the state dict with a State view into x, or a BatchState
+	if x holds many operating points
+	"""
+	def bind(self,x,offset):
+		keys = self.state.keys()
+		for i,k in enumerate(keys):
+			x[offset+i] = self.state[k]
+		if x.ndim == 1:
+			self.state = State(keys,x,offset)
+		else:
+			self.state = BatchState(keys,x,offset)
+
 	"""
 	R: Residual function
 
@@ -81,6 +201,66 @@ class Block(object):
 		return reduce(lambda x, y: dict((k, v + y[k]) for k, v in x.iteritems()), \
 			[F.F() for F in self.F] + [S.S(self) for S in self.S])
 
+	"""
+	residual: Array residual function
+
+	input(s):  (out) global array of floats for the residual
+	output(s): None
+
+	same sum as R, but accumulated into the block's entries of out,
+	which are given by the index of its (bound) State
+	"""
+	def residual(self,out):
+		index = self.state.index
+		r = dict.fromkeys(index,0.)
+		for F in self.F:
+			for k,v in F.F().iteritems():
+				r[k] += v
+		for S in self.S:
+			for k,v in S.S(self).iteritems():
+				r[k] += v
+		for k,v in r.iteritems():
+			out[index[k]] = v
+
+	"""
+	pattern: Jacobian sparsity of this block's residual
+
+	input(s):  (index) dict from id(block) to a dict of the
+						 global index of each of its states
+	output(s): (rows,cols) lists of global indices of nonzeros
+
+	each block depends on its own states and the states of its flux
+	neighbours that are in the problem (in index). Diagonal fluxes 
+	(eg. difference) only couple a state to the same state of their neighbour
+	"""
+	def pattern(self,index):
+		rows = []
+		cols = []
+		own = index[id(self)]
+		diagonal = all(F.f in F.diagonal for F in self.F) and \
+			all(S.s in S.constant for S in self.S)
+		for k in own:
+			rows.append(own[k])
+			cols.append(own[k])
+			if not diagonal:
+				for kk in own:
+					rows.append(own[k])
+					cols.append(own[kk])
+		for F in self.F:
+			if id(F.N) not in index:
+				continue
+			N = index[id(F.N)]
+			for k in own:
+				if F.f in F.diagonal:
+					if k in N:
+						rows.append(own[k])
+						cols.append(N[k])
+				else:
+					for kk in N:
+						rows.append(own[k])
+						cols.append(N[kk])
+		return (rows,cols)
+
 	def printMe(self):
 		print self.name, [s + '=' + str(self.state[s]) for s in self.state]
 
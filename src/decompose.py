@@ -0,0 +1,324 @@
+"""
+decompose.py contains the Domain Class, a Problem split over processes
+
+The blocks of an array-backed Problem are partitioned into subdomains,
+and each subdomain's residual is evaluated in its own worker process.
+The global state and residual arrays are moved into shared memory, so
+a worker reads the states of its neighbours' interface blocks straight
+from the shared state, and nothing but the time is sent per residual.
+
+Jacobians are colored finite differences of the parallel residual,
+and the Newton steps are solved with GMRES preconditioned by restricted
+additive Schwarz: each subdomain, grown by one layer of neighbouring
+unknowns, is factored and solved in its own worker, and only its own
+unknowns are kept. The residuals to precondition and the corrections
+are passed through shared arrays too.
+
+The whole Problem is built in the parent, and the workers are forked
+from it when the Domain is made, so they see the Problem as it was then
+and inputs (eg. declared parameters) are set beforehand. Each worker
+only evaluates and factors its own subdomain, but memory for the whole
+Problem is still needed in the parent.
+
+An error in a worker is sent back and raised in the parent, as is a
+worker that exits or does not answer within the timeout. A worker that
+does not answer is terminated, and as the subdomain of a worker that
+is gone cannot be evaluated any more, the Domain is then unusable and
+every later command raises.
+
+Each Domain has:
+	(.P) the Problem
+	(.parts) the subdomain of each block of the Problem
+	(.rows) the global unknowns of each subdomain
+	(.grown) the unknowns of each subdomain with one layer of overlap,
+		and (.own) which of them belong to the subdomain
+	(.workers) worker processes, and (.pipes) the ends of their pipes
+	(.timeout) seconds to wait for the workers
+	(.broken) None, or why the Domain can no longer be used
+
+------------------------------------
+function tests are run by doctest
+python decompose.py
+------------------------------------
+>>> import blocks, flux, problem
+>>> n = 12
+>>> B = [blocks.Block(str(i),None,u = 0.) for i in range(n)]
+>>> B[0].state['u'] = 1.
+>>> for i in range(1,n-1):
+... 	B[i].addFlux(flux.Flux(B[i-1],'difference',{'d':1.,'m':[]}))
+... 	B[i].addFlux(flux.Flux(B[i+1],'difference',{'d':1.,'m':[]}))
+>>> P = problem.Problem(B[1:-1],array = True)
+>>> D = Domain(P,3)
+>>> D.parts
+array([2, 2, 2, 1, 1, 1, 0, 0, 0, 0])
+>>> D.solve()
+>>> D.close()
+>>> P.info['converged']
+True
+>>> np.round(P.getSolution(),6)
+array([0.909091, 0.818182, 0.727273, 0.636364, 0.545455, 0.454545,
+       0.363636, 0.272727, 0.181818, 0.090909])
+"""
+import multiprocessing
+import traceback
+import warnings
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.csgraph as csgraph
+import scipy.sparse.linalg as spla
+import jacobian
+import newton
+
+"""
+partition:		splits the blocks of a Problem into subdomains
+
+input(s):   (P) Problem
+						(k) number of subdomains
+output(s):	the subdomain of each block
+
+the blocks are ordered by reverse Cuthill-McKee over the flux graph,
+which keeps neighbours close, and the order is cut into k runs
+of about the same number of unknowns
+"""
+def partition(P,k):
+	pattern = P.sparsity()
+	if P.batch is not None:
+		pattern = pattern[::P.batch,::P.batch]
+	block = np.array([i for (i,label) in P.mapping])
+	# block graph, from the unknowns' graph
+	C = sp.coo_matrix(pattern)
+	G = sp.csr_matrix((np.ones(len(C.row)),(block[C.row],block[C.col])),shape=(len(P.b),len(P.b)))
+	order = csgraph.reverse_cuthill_mckee(G,symmetric_mode = True)
+	size = np.bincount(block,minlength = len(P.b))[order]
+	# cut where the running count of unknowns passes each k-th
+	cut = np.minimum((np.cumsum(size) - size)*k/max(size.sum(),1),k-1)
+	parts = np.zeros(len(P.b),dtype=int)
+	parts[order] = cut
+	return parts
+
+"""
+work:				worker loop, for the commands received
+
+input(s):   (P) Problem, with its arrays in shared memory
+						(blocks) the blocks of the subdomain
+						(grown, own) the subdomain's unknowns with overlap, and
+							which of them are its own
+						(r, x) shared arrays, the residual to precondition and
+							the correction
+						(pipe) end of the pipe to the parent
+output(s):	None
+
+('residual',t) evaluates the residual of the blocks into P.res,
+('factor',J) factors the grown subdomain's Jacobian J,
+('apply',) writes the subdomain's own unknowns of the correction
+and None stops. Each command is answered with ('ok',None), or
+('error',traceback) if it raised
+"""
+def work(P,blocks,grown,own,r,x,pipe):
+	lu = None
+	while True:
+		command = pipe.recv()
+		if command is None:
+			break
+		try:
+			if command[0] == 'residual':
+				P.update(P.x,command[1])
+				for b in blocks:
+					b.residual(P.res)
+			elif command[0] == 'factor':
+				lu = spla.splu(sp.csc_matrix(command[1]))
+			elif command[0] == 'apply':
+				x[grown[own]] = lu.solve(r[grown])[own]
+			else:
+				raise ValueError('unknown command ' + str(command[0]))
+			pipe.send(('ok',None))
+		except Exception:
+			pipe.send(('error',traceback.format_exc()))
+
+def shared(a):
+	""" a copy of array a in shared memory """
+	s = np.frombuffer(multiprocessing.RawArray('d',a.size)).reshape(a.shape)
+	s[:] = a
+	return s
+
+class Domain(object):
+	"""
+	Domain Class
+
+	__init__:		Domain Constructor, moves the Problem's arrays into
+							shared memory and starts a worker per subdomain
+
+	input(s):   (P) array-backed Problem
+							(k) number of subdomains, defaults to the number of cores
+							(timeout) seconds to wait for the workers on each command
+	output(s):	None
+	"""
+	def __init__(self,P,k = None,timeout = 600.):
+		if not P.array:
+			raise ValueError('only array-backed Problems can be decomposed')
+		k = k or multiprocessing.cpu_count()
+		self.P = P
+		self.timeout = timeout
+		self.broken = None
+		self.parts = partition(P,k)
+		P.x = shared(P.x)
+		P.res = shared(P.res)
+		offset = 0
+		for b in P.b:
+			b.bind(P.x,offset)
+			offset += len(b.labels())
+		block = np.array([i for (i,label) in P.mapping])
+		nb = 1 if P.batch is None else P.batch
+		# global unknowns, with every operating point of a batch
+		self.rows = [(nb*np.flatnonzero(self.parts[block] == p)[:,None] + np.arange(nb)).ravel() \
+			for p in range(k)]
+		# one layer of overlap, from the Jacobian's sparsity
+		pattern = sp.csr_matrix(P.sparsity())
+		self.grown = []
+		self.own = []
+		for rows in self.rows:
+			mask = np.zeros(pattern.shape[0],dtype=bool)
+			mask[rows] = True
+			grown = np.flatnonzero(mask | (pattern.T.dot(mask) > 0))
+			self.grown.append(grown)
+			self.own.append(mask[grown])
+		self.rin = shared(np.zeros(pattern.shape[0]))
+		self.xout = shared(np.zeros(pattern.shape[0]))
+		self.pipes = []
+		self.workers = []
+		for p in range(k):
+			(mine,theirs) = multiprocessing.Pipe()
+			w = multiprocessing.Process(target = work, \
+				args = (P,[b for i,b in enumerate(P.b) if self.parts[i] == p], \
+				self.grown[p],self.own[p],self.rin,self.xout,theirs))
+			w.daemon = True
+			w.start()
+			# the parent's copy of the worker's end, so that a worker
+			# that exits is seen as the end of its pipe
+			theirs.close()
+			self.pipes.append(mine)
+			self.workers.append(w)
+
+	"""
+	call:				sends a command to each worker and waits for all of them
+
+	input(s):   (commands) one command per worker
+	output(s):	None, raises RuntimeError if a worker failed, exited
+							or did not answer, or if the Domain is unusable
+	"""
+	def call(self,commands):
+		if self.broken is not None:
+			raise RuntimeError('the Domain can no longer be used, ' + self.broken)
+		errors = []
+		lost = []
+		sent = []
+		for p,(pipe,command) in enumerate(zip(self.pipes,commands)):
+			try:
+				pipe.send(command)
+				sent.append(p)
+			except (IOError,OSError):
+				lost.append('worker ' + str(p) + ' exited')
+		# every answer is read, so the pipes stay in step after an error
+		for p in sent:
+			pipe = self.pipes[p]
+			if not pipe.poll(self.timeout):
+				# its answer could still come, and be read as the next one
+				self.workers[p].terminate()
+				lost.append('worker ' + str(p) + ' did not answer in ' + str(self.timeout) + ' s')
+				continue
+			try:
+				(status,message) = pipe.recv()
+			except EOFError:
+				lost.append('worker ' + str(p) + ' exited')
+				continue
+			if status == 'error':
+				errors.append('worker ' + str(p) + ' failed:\n' + message)
+		if lost:
+			self.broken = ', '.join(lost)
+		if errors or lost:
+			raise RuntimeError('\n'.join(lost + errors))
+
+	"""
+	r:					parallel global residual, as Problem.r
+
+	input(s):   (solution) global array of floats corresponding to mapping
+							(t) time
+	output(s):	copy of the global residual
+	"""
+	def r(self,solution,t = 0):
+		P = self.P
+		P.x[:] = np.reshape(solution,P.x.shape)
+		self.call([('residual',t)]*len(self.pipes))
+		return P.res.flatten()
+
+	def jacobian(self,solution,t = 0):
+		P = self.P
+		pattern = P.sparsity()
+		return jacobian.fdJacobian(lambda x: self.r(x,t),solution,pattern,P.colors)
+
+	"""
+	schwarz:		restricted additive Schwarz preconditioned GMRES solve of J dx = b
+
+	input(s):   (J) sparse matrix
+							(b) right hand side
+							(tol) relative tolerance
+	output(s):	dx, array of floats
+
+	the subdomains are factored and solved in the workers. GMRES
+	stopping short of tol warns, a breakdown raises RuntimeError
+	"""
+	def schwarz(self,J,b,tol = 1e-8):
+		J = sp.csr_matrix(J)
+		self.call([('factor',J[grown][:,grown]) for grown in self.grown])
+		def apply(r):
+			self.rin[:] = r
+			self.call([('apply',)]*len(self.pipes))
+			return np.copy(self.xout)
+		M = spla.LinearOperator(J.shape,apply,dtype=float)
+		dx, info = spla.gmres(J,b,tol = tol,atol = 0.,restart = 50,M = M)
+		if info < 0:
+			raise RuntimeError('GMRES broke down, info ' + str(info))
+		if info > 0:
+			warnings.warn('GMRES did not reach tol in ' + str(info) + ' iterations',RuntimeWarning)
+		return dx
+
+	"""
+	solve:			Newton solve with the parallel residual and Jacobian,
+							and Schwarz preconditioned steps
+
+	input(s):   (options) passed to newton.newton, eg. tol, rtol, maxiter
+	output(s):	None
+
+	as Problem.solve, a solve that does not converge warns, and leaves
+	P.info['converged'] False, which callers check
+	"""
+	def solve(self,**options):
+		P = self.P
+		options['linear'] = self.schwarz
+		if P.batch is not None:
+			# as Problem.solve, each operating point stops on its own
+			options.setdefault('groups',np.tile(np.arange(P.batch),len(P.mapping)))
+		solution, P.info = newton.newton(self.r,P.getSolution(),self.jacobian,**options)
+		P.update(solution)
+
+	"""
+	close:			stops the workers, including after a worker has exited
+	"""
+	def close(self):
+		for pipe in self.pipes:
+			try:
+				pipe.send(None)
+			except (IOError,OSError):
+				pass
+			pipe.close()
+		for w in self.workers:
+			w.join(self.timeout)
+			if w.is_alive():
+				w.terminate()
+				w.join()
+		self.pipes = []
+		self.workers = []
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
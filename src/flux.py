@@ -17,6 +17,24 @@ Should we have a state dependent material inside a flux,
 ie if glass properties depended on temperature
 then glass should be a block itself
 
+Flux functions are looked up by name in the kernels registry.
+Each kernel can have a setup function, which precomputes the
+constants of a flux (resistances, film coefficients) once, when 
+the flux is added to a block and again when a Problem is built,
+leaving only the state dependent part in the flux function itself.
+New flux functions are added with register, eg.
+
+>>> def radiation(self):
+... 	return {'T':self.eps*(self.N.state['T']**4-self.B.state['T']**4)}
+>>> def radiationSetup(self):
+... 	self.eps = 5.67e-8*self.G['e']
+>>> register('radiation',radiation,radiationSetup)
+>>> import blocks
+>>> a = blocks.Block('a','air',T = 300.)
+>>> a.addFlux(Flux(blocks.Block('b','air',T = 310.),'radiation',{'e':0.9,'m':[]}))
+>>> round(a.F[0].F()['T'],4)
+57.9298
+
 ------------------------------------
 function tests are run by doctest
 python flux.py
@@ -34,16 +52,21 @@ class Flux(object):
 	__init__:		Flux Constructor
 
 	input(s):   (N) Neighboring block
-							(f) Flux function name
+							(f) Flux function name, in kernels
 							(G) Geometry (optional)
 								For now, geometry is not required, 
 								as some fluxes don't need it
 	output(s):	None
 	"""
+	# flux functions where each state only depends on
+	# the same state of the block and its neighbour
+	diagonal = set()
+
 	def __init__(self,N,f,G=None):
 		self.B = None # this will be set when its added to the block
 		self.N = N
-		self.F = eval('self.'+f) # set up the function
+		self.f = f
+		self.F = kernels[f][0].__get__(self,Flux) # set up the function
 		self.m = []
 		
 		if G is not None:
@@ -52,6 +75,21 @@ class Flux(object):
 			for i in range(0,n-2):
 				self.m.append(materials.__dict__.get(G['m'][i],0))
 
+	"""
+	setup:			precomputes the constants of the flux function
+
+	input(s):   None
+	output(s):	None
+
+	called once the flux belongs to a block, see Block.addFlux,
+	and again by the Problem, after any attributes needed 
+	by the flux (eg. areas .A) have been set
+	"""
+	def setup(self):
+		init = kernels[self.f][1]
+		if init is not None:
+			init(self)
+
 	"""
 	The following are all flux function choices defined with
 
@@ -69,63 +107,95 @@ class Flux(object):
 	"""
 
 	def heatCondSimple(self):
-	
+		return {'T':(self.B.state['T']-self.N.state['T'])*self.h}
+
+	def heatCondSimpleSetup(self):
 		# All per meter
-		if(self.G['type'] == 'ext'):
-			# h = 1.5583718700478653
-			h = 0.5233
-		elif(self.G['type'] == 'int'):
-			# h = 0.5240370865137535
-			h = 1.6124
-		elif(self.G['type'] == 'wa'):
-			h = 0.16079175187974612
-		else:
-			h = 0
+		# a film coefficient given in the geometry, eg. a calibrated one
+		# (calibrate.py), takes the place of the default for the type
+		h = self.G.get('h',films.get(self.G['type'],0))
 		# h *= self.G['L']/1000.
 		# h = 0
 		h *= 0.3/1000.
-		return {'T':(self.B.state['T']-self.N.state['T'])*h}
+		self.h = h
 
 	def heatConduction(self):
 
 		"""
-		returns the convection heat transfer coefficient at a specific temperature
+		the convection heat transfer coefficient at a specific temperature,
+		the constant part is in self.hc, and the Reynolds number part is
+		only computed for the air correlations
 
 		"""
-		def h(b):
-			
-			m = self.B.m
-			h = m['k'](self.B.state)/self.G['cL']
-			if(m['name'] == 'water' and self.G['type'] == 'cyl'):
-				# Nu_D for Reynold numbers < 2300 (laminar) 
-				# and constant wall temperature. 
-				# Could use Nu_D = 4.36 for constant heat transfer.
-				h *= 3.66
-			elif(m['name'] == 'air' and self.G['type'] == 'cyl'):
-				Re = self.B.mdot/m['rho'](self.B.state)*self.G['cL']/m['mu'](self.B.state)	
-				h *= 0.037*Re**(4.0/5.0)*m['Pr'](self.B.state)**(1.0/3.0)
-			elif(m['name'] == 'air' and self.G['type'] == 'plateLayer'):
-				Re = self.B.mdot/m['rho'](self.B.state)*self.G['cL']/m['mu'](self.B.state)
-				h *= 0.0296*Re**(4.0/5.0)*m['Pr'](self.B.state)**(1.0/3.0)
-			elif(m['name'] == 'glass'):
-				pass
-		
-			return h		
-		# temperature doesnt matter in the layers, as the k are constant
-
-		Res = 1/(self.A[0]*h(self.B)) + \
-					np.dot([1/m['k']() for m in self.m],[1/A for A in self.A[1:-1]]) + \
-					1/(self.A[-1]*h(self.N))
-		# print np.array([A for A in self.A[1:-1]])
+		m = self.B.m
+		state = self.B.state
+		h = m['k'](state)/self.G['cL']*self.hc
+		if self.Re:
+			Re = self.B.mdot/m['rho'](state)*self.G['cL']/m['mu'](state)
+			h *= Re**(4.0/5.0)*m['Pr'](state)**(1.0/3.0)
+
+		Res = 1/(self.A[0]*h) + self.Rlayers + 1/(self.A[-1]*h)
 		return {'T':(self.N.state['T']-self.B.state['T'])/Res}
 
+	def heatConductionSetup(self):
+		m = self.B.m
+		self.hc = 1.
+		self.Re = False
+		if(m['name'] == 'water' and self.G['type'] == 'cyl'):
+			# Nu_D for Reynold numbers < 2300 (laminar) 
+			# and constant wall temperature. 
+			# Could use Nu_D = 4.36 for constant heat transfer.
+			self.hc = 3.66
+		elif(m['name'] == 'air' and self.G['type'] == 'cyl'):
+			self.hc = 0.037
+			self.Re = True
+		elif(m['name'] == 'air' and self.G['type'] == 'plateLayer'):
+			self.hc = 0.0296
+			self.Re = True
+		elif(m['name'] == 'glass'):
+			pass
+		# temperature doesnt matter in the layers, as the k are constant
+		if hasattr(self,'A'):
+			self.Rlayers = np.dot([1/m['k']() for m in self.m],[1/A for A in self.A[1:-1]])
+
 	def heatConvection(self):
 		return {'T':self.B.mdot*self.B.m['Cp'](self.B.state)*(self.B.state['T']-self.N.state['T'])}
 
 	def difference(self):
 		return dict((s,(self.N.state[s]-self.B.state[s])/self.G['d']) for s in self.B.state)
 
+# default film coefficients of heatCondSimple, per meter, by geometry type
+films = {
+	'ext':0.5233, # 1.5583718700478653
+	'int':1.6124, # 0.5240370865137535
+	'wa':0.16079175187974612,
+}
+
+# flux functions by name, each entry is (function, setup),
+# where setup precomputes the constants of a flux, or is None
+kernels = {}
 
+"""
+register:		adds a flux function to the kernels
+
+input(s):   (name) flux function name, as passed to Flux
+						(F) flux function, F(flux) returns a dict of states 
+						(setup) optional function, setup(flux) precomputes constants
+						(diagonal) True if each state only depends on the same
+							state of the block and its neighbour
+output(s):	None
+"""
+def register(name,F,setup = None,diagonal = False):
+	kernels[name] = (F,setup)
+	if diagonal:
+		Flux.diagonal.add(name)
+	else:
+		Flux.diagonal.discard(name)
+
+register('heatCondSimple',Flux.__dict__['heatCondSimple'],Flux.__dict__['heatCondSimpleSetup'])
+register('heatConduction',Flux.__dict__['heatConduction'],Flux.__dict__['heatConductionSetup'])
+register('heatConvection',Flux.__dict__['heatConvection'])
+register('difference',Flux.__dict__['difference'],diagonal = True)
 
 if __name__ == "__main__":
 	import doctest
@@ -0,0 +1,226 @@
+"""
+grid.py contains the Grid Class, a structured set of blocks
+
+A Grid replaces the (n+2) x (m+2) Blocks and 4nm 'difference' Fluxes
+of a uniform grid, such as in poisson2D.py and diffusion2D.py,
+with one object holding each state as a 2-D array.
+
+Each Grid has:
+	(.name) string identifying the grid's name (or ID)
+	(.G) the difference flux geometry, G['d'] is the divisor
+	(.state) OrderedDict of 2-D arrays, each with a layer of ghost
+		cells around the interior. The ghost cells play the part of
+		the boundary blocks and are not solved for
+	(.S) list of sources, which return a dict of arrays
+		(or floats) over the interior cells
+	(.bc) list of sources driving the ghost cells, which return a dict
+		of arrays (or floats) over the ghost cells, ordered as in .ring
+	(.ring) index arrays of the ghost cells
+	(.F) no fluxes, the difference stencil is built in
+	(.t) time
+	(.position) optional coordinates of the interior cells, a tuple of
+		arrays of the interior shape, used by the Problem's spatial index
+
+The residual of each interior cell is
+R = sum over the 4 neighbours of (U_N - U)/G['d'] + Sum(Sources)
+evaluated as a single array expression.
+
+Grids only work in an array-backed Problem, where the interior of
+each state is copied from the global array before every residual
+
+------------------------------------
+function tests are run by doctest
+python grid.py
+------------------------------------
+>>> u = np.zeros((4,5))
+>>> u[0,:] = 1.
+>>> g = Grid('test',{'type':'edge','d':1.},u = u)
+>>> g.labels()[:3]
+[('u', 1, 1), ('u', 1, 2), ('u', 1, 3)]
+>>> x = np.zeros(6)
+>>> out = np.zeros(6)
+>>> g.bind(x,0)
+>>> g.residual(out)
+>>> out
+array([1., 1., 1., 0., 0., 0.])
+>>> import grid, problem, source
+>>> source.register('exchange',lambda S,g: {'u':g.state['v'][1:-1,1:-1]**2,'v':-g.state['u'][1:-1,1:-1]})
+>>> g = grid.Grid('test',{'type':'edge','d':1.},u = u,v = np.ones((4,5)))
+>>> g.addSource(source.Source('exchange'))
+>>> P = problem.Problem([g])
+>>> x = np.linspace(1.,2.,12)
+>>> J = P.jacobian(x).toarray()
+>>> E = np.array([(P.r(x + 1e-7*e) - P.r(x))/1e-7 for e in np.eye(12)]).T
+>>> np.abs(J - E).max() < 1e-5
+True
+"""
+import numpy as np
+from collections import OrderedDict
+
+class Grid(object):
+	"""
+	Grid Class
+
+	__init__: 	Object Constructor
+
+	input(s):   (s) string corresponding to grid name
+							(G) difference flux geometry
+							(t) time
+							(initialStates) key-value pairs of 2-D arrays with
+								initial conditions, including the ghost cells
+	output(s):	None
+	"""
+	def __init__(self,s,G,t = 0,**initialStates):
+		self.name = s
+		self.G = G
+		self.state = OrderedDict((k,np.array(v,dtype=float)) for k,v in sorted(initialStates.items()))
+		self.S = []
+		self.bc = []
+		self.F = []
+		self.t = t
+		shape = self.state.values()[0].shape
+		self.shape = (shape[0]-2,shape[1]-2)
+		# ghost cells, in the order of the rows then the columns
+		ii, jj = np.indices(shape)
+		ghost = (ii == 0) | (ii == shape[0]-1) | (jj == 0) | (jj == shape[1]-1)
+		self.ring = (ii[ghost],jj[ghost])
+		self.views = None
+
+	"""
+	addSource:	 Grid Setup Functions
+	addBoundary:
+
+	input(s):  (S) Source objects, evaluated on the interior or ghost cells
+	output(s): None
+	"""
+	def addSource(self,S):
+		self.S.append(S)
+
+	def addBoundary(self,S):
+		self.bc.append(S)
+
+	"""
+	labels: the labels of the interior cells, (state, i, j)
+		ordered by state, then row-major
+
+	input(s):  None
+	output(s): list of labels
+	"""
+	def labels(self):
+		return [(k,i,j) for k in self.state for i in range(1,self.shape[0]+1) for j in range(1,self.shape[1]+1)]
+
+	"""
+	bind: Array Setup Function
+
+	input(s):  (x) global array of floats
+						 (offset) index of this grid's first state in x
+	output(s): None
+
+	copies the interior of each state into x, and keeps 2-D views of x
+	"""
+	def bind(self,x,offset):
+		n = self.shape[0]*self.shape[1]
+		self.offset = offset
+		self.views = OrderedDict()
+		for k in self.state:
+			self.views[k] = x[offset:offset+n].reshape(self.shape)
+			self.views[k][:] = self.state[k][1:-1,1:-1]
+			offset += n
+
+	"""
+	sync: copies the bound interior values into the states,
+		and drives the ghost cells with the boundary sources at time .t
+
+	input(s):  None
+	output(s): None
+	"""
+	def sync(self):
+		for k in self.state:
+			self.state[k][1:-1,1:-1] = self.views[k]
+		for S in self.bc:
+			for k,v in S.S(self).iteritems():
+				self.state[k][self.ring] = v
+
+	"""
+	residual: Array residual function
+
+	input(s):  (out) global array of floats for the residual
+	output(s): None
+
+	the 5 point difference stencil over every interior cell at once
+	"""
+	def residual(self,out):
+		n = self.shape[0]*self.shape[1]
+		offset = self.offset
+		sources = [S.S(self) for S in self.S]
+		for k,U in self.state.iteritems():
+			R = (U[:-2,1:-1] + U[2:,1:-1] + U[1:-1,:-2] + U[1:-1,2:] - 4.*U[1:-1,1:-1])/self.G['d']
+			for s in sources:
+				R += s[k]
+			out[offset:offset+n] = R.ravel()
+			offset += n
+
+	"""
+	coupled: whether the states of a cell depend on each other,
+		through sources that depend on the state
+
+	input(s):  None
+	output(s): boolean
+	"""
+	def coupled(self):
+		return len(self.state) > 1 and not all(S.s in S.constant for S in self.S)
+
+	"""
+	pattern: Jacobian sparsity of the grid's residual
+
+	input(s):  (index) unused, the grid only couples to itself
+	output(s): (rows,cols) arrays of global indices of nonzeros
+
+	each state couples to its 4 neighbours, and with state dependent
+	sources to every state of its own cell
+	"""
+	def pattern(self,index):
+		(n,m) = self.shape
+		cell = np.arange(n*m).reshape(n,m)
+		rows = [cell.ravel()]
+		cols = [cell.ravel()]
+		for (a,b) in [(cell[1:,:],cell[:-1,:]),(cell[:-1,:],cell[1:,:]), \
+			(cell[:,1:],cell[:,:-1]),(cell[:,:-1],cell[:,1:])]:
+			rows.append(a.ravel())
+			cols.append(b.ravel())
+		rows = np.concatenate(rows)
+		cols = np.concatenate(cols)
+		k = len(self.state)
+		rows = [rows + self.offset + i*n*m for i in range(k)]
+		cols = [cols + self.offset + i*n*m for i in range(k)]
+		if self.coupled():
+			for i in range(k):
+				for j in range(k):
+					if i != j:
+						rows.append(cell.ravel() + self.offset + i*n*m)
+						cols.append(cell.ravel() + self.offset + j*n*m)
+		return (np.concatenate(rows),np.concatenate(cols))
+
+	"""
+	colors: Jacobian column groups of the grid's states
+
+	input(s):  None
+	output(s): integer array, the color of each interior cell, ordered as labels
+
+	(i + 2j) mod 5 never repeats within two cells of the stencil,
+	so the 5 point stencil needs only 5 residual evaluations per Jacobian.
+	The states of coupled cells get colors of their own
+	"""
+	def colors(self):
+		(i,j) = np.indices(self.shape)
+		c = ((i + 2*j) % 5).ravel()
+		if self.coupled():
+			return np.concatenate([c + 5*k for k in range(len(self.state))])
+		return np.tile(c,len(self.state))
+
+	def printMe(self):
+		print self.name, [s + '=' + str(self.state[s][1:-1,1:-1]) for s in self.state]
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
@@ -0,0 +1,98 @@
+"""
+jacobian.py contains the sparse finite difference Jacobian functions
+
+The sparsity pattern of a Problem is known from its fluxes,
+as each flux only connects its block (.B) to its neighbour (.N).
+Columns of the Jacobian that never share a row can be perturbed
+together, so the columns are grouped (colored) once, and every
+Jacobian then costs one residual evaluation per color rather than
+one per state.
+
+------------------------------------
+function tests are run by doctest
+python jacobian.py
+------------------------------------
+>>> P = sp.csr_matrix(np.array([[1,1,0,0],[1,1,1,0],[0,1,1,1],[0,0,1,1]]))
+>>> colors = color(P)
+>>> colors
+array([0, 1, 2, 0])
+>>> r = lambda x: np.array([x[0]+x[1]**2,x[0]-x[1]+x[2],2*x[2]*x[1]+x[3],x[2]+x[3]**3])
+>>> x = np.array([1.,2.,3.,4.])
+>>> J = fdJacobian(r,x,P,colors)
+>>> np.round(J.toarray(),4)
+array([[ 1.,  4.,  0.,  0.],
+       [ 1., -1.,  1.,  0.],
+       [ 0.,  6.,  4.,  1.],
+       [ 0.,  0.,  1., 48.]])
+"""
+import numpy as np
+import scipy.sparse as sp
+
+"""
+color:			greedy column coloring of a sparsity pattern
+
+input(s):   (pattern) sparse matrix, nonzeros mark the dependencies
+output(s):	integer array with the color (group) of each column
+
+two columns get different colors if they have a nonzero in the same row,
+so every column in a group can be perturbed at the same time
+"""
+def color(pattern):
+	P = sp.csc_matrix(pattern,dtype=bool)
+	# columns that share a row are neighbours
+	C = sp.csr_matrix(P.T*P)
+	n = P.shape[1]
+	colors = -np.ones(n,dtype=int)
+	for j in range(n):
+		used = set(colors[C.indices[C.indptr[j]:C.indptr[j+1]]])
+		c = 0
+		while c in used:
+			c += 1
+		colors[j] = c
+	return colors
+
+"""
+fdJacobian:	sparse finite difference Jacobian of r at x
+
+input(s):   (r) residual function r(x)
+						(x) array of floats to evaluate the Jacobian at
+						(pattern) sparse matrix of the Jacobian's nonzeros
+						(colors) column groups, from color(pattern)
+						(r0) optional r(x), if already known
+						(eps) relative perturbation size
+						(dense) return a dense array, cheaper for small systems
+output(s):	Jacobian as a scipy.sparse csr_matrix, or array if dense
+
+one (forward difference) residual evaluation per color
+"""
+def fdJacobian(r,x,pattern,colors,r0 = None,eps = None,dense = False):
+	P = sp.csr_matrix(pattern)
+	rows = np.repeat(np.arange(P.shape[0]),np.diff(P.indptr))
+	cols = P.indices
+	x = np.asarray(x,dtype=float)
+	if r0 is None:
+		r0 = np.array(r(x),dtype=float)
+	if eps is None:
+		eps = np.sqrt(np.finfo(float).eps)
+	h = eps*np.maximum(np.abs(x),1.)
+	# use the actual step, as x + h is rounded. Each column is in
+	# one group, so the steps of every group are found at once
+	dx = (x + h) - x
+	ncolors = colors.max()+1 if len(colors) else 0
+	dr = np.zeros((ncolors,len(r0)))
+	for c in range(ncolors):
+		group = colors == c
+		xp = x.copy()
+		xp[group] += h[group]
+		dr[c] = np.array(r(xp),dtype=float) - r0
+	# each nonzero from the residual change of its column's group
+	data = dr[colors[cols],rows]/dx[cols]
+	if dense:
+		J = np.zeros(P.shape)
+		J[rows,cols] = data
+		return J
+	return sp.csr_matrix((data,P.indices.copy(),P.indptr.copy()),shape=P.shape)
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
@@ -5,18 +5,21 @@ Each definition is a dictionary and has
 	name 
 	type (not used yet...)
 	property functions 
-		which are defined either as inline (lambda)
-		or can be defined externally in this file
+		which are defined either as polynomials (Property),
+		inline (lambda), or can be defined externally in this file
 		They are a function of one or more state variables
 		defined in the OrderedDict 'state'
 		Any material can have any set of functions
 
-	Eg. 'rho':lambda state : np.polyval([-0.003416,-0.09298,1001],state['T'])
+	Eg. 'rho':Property([-0.003416,-0.09298,1001])
 	is equal to 
 	rho =  state['T']*state['T']*-0.003416 + state['T']*-0.09298 + 1001
-	where an optional state = 0 is used for materials that are inside fluxes,
-	where their constant value ensures we don't explicitly have to know their
-	temperature
+	where constant properties don't need a state, as they are used 
+	for materials that are inside fluxes, where their constant value 
+	ensures we don't explicitly have to know their temperature
+
+Polynomials are evaluated with Horner's rule, on floats or on whole
+arrays of states (eg. the operating points of a batch).
 
 ------------------------------------
 function tests are below as run by doctest
@@ -32,63 +35,102 @@ python materials.py
 >>> glass['k'](state)
 1.05
 
+>>> air['rho']({'T':np.array([20.,30.])})
+array([1.2034 , 1.16385])
+
 """
 import numpy as np
+
+class Property(object):
+	"""
+	Property Class, a polynomial material property
+
+	__init__:		Property Constructor
+
+	input(s):   (c) polynomial coefficients, highest power first, as np.polyval
+							(s) the state variable it is a function of
+	output(s):	None
+
+	calling the property with a state evaluates the polynomial at state[s]
+	"""
+	def __init__(self,c,s = 'T'):
+		self.c = [float(ci) for ci in c]
+		self.s = s
+
+	def __call__(self,state = 0):
+		c = self.c
+		if len(c) == 1:
+			return c[0]
+		return horner(c,state[self.s])
+
+"""
+horner:			evaluates a polynomial with Horner's rule
+
+input(s):   (c) coefficients, highest power first, as np.polyval
+						(x) float or array to evaluate at
+output(s):	value(s) of the polynomial at x
+"""
+def horner(c,x):
+	v = c[0]
+	for ci in c[1:]:
+		v = v*x + ci
+	return v
+
 constWater = \
 {
 	'name':'constWater',
 	'type':'liquid',
-	'Cp': lambda state = 0 : 4.218,
-	'rho': lambda state = 0: 998
+	'Cp': Property([4.218]),
+	'rho':Property([998])
 }
 constAir = \
 {
 	'name':'constAir',
 	'type':'liquid',
-	'Cp': lambda state = 0 : 1.005,
-	'rho':lambda state = 0 : 1.20
+	'Cp': Property([1.005]),
+	'rho':Property([1.20])
 }
 water = \
 {
 	'name':'water',
 	'type':'liquid',
-	'rho':lambda state : np.polyval([-0.003416,-0.09298,1001],state['T']),
-	'Cp': lambda state : np.polyval([-4.178e-11,1.384e-08,-1.737e-06, 0.0001115,-0.003429,4.218],state['T']),
-	'k':  lambda state : np.polyval([- 0.00001118, 0.002257, 0.5587],state['T'])
+	'rho':Property([-0.003416,-0.09298,1001]),
+	'Cp': Property([-4.178e-11,1.384e-08,-1.737e-06, 0.0001115,-0.003429,4.218]),
+	'k':  Property([- 0.00001118, 0.002257, 0.5587])
 }
 air = \
 {
 	'name':'air',
 	'type':'gas',
-	'rho':lambda state : np.polyval([1.75e-05,-0.00483,1.293],state['T']),
-	'Cp': lambda state : np.polyval([1.005],state['T']),
-	'k':  lambda state : np.polyval([7e-05,0.0243],state['T']),
-	'Pr': lambda state : np.polyval([-4.705e-19,-0.0001,0.715],state['T']),
-	'mu': lambda state : np.polyval([7.5e-11,8.88e-08, 1.33e-05],state['T'])
+	'rho':Property([1.75e-05,-0.00483,1.293]),
+	'Cp': Property([1.005]),
+	'k':  Property([7e-05,0.0243]),
+	'Pr': Property([-4.705e-19,-0.0001,0.715]),
+	'mu': Property([7.5e-11,8.88e-08, 1.33e-05])
 }
 silicon_tubing = \
 {
 	'name':'silicon tubing',
 	'type':'solid',
-	'k':  lambda state = 0: 0.145
+	'k':  Property([0.145])
 }
 silicon_insulation = \
 {
 	'name':'silicon insulation',
 	'type':'solid',
-	'k':  lambda state = 0: 0.037
+	'k':  Property([0.037])
 }
 glass = \
 {
 	'name':'glass',
 	'type':'solid',
-	'k':  lambda state = 0: 1.05
+	'k':  Property([1.05])
 }
 argon = \
 {
 	'name':'argon',
 	'type':'gas',
-	'k':  lambda state = 0: 0.016
+	'k':  Property([0.016])
 }
 # function testing
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+"""
+multigrid.py contains the multigrid linear solver
+
+Solves J dx = b, for J the Jacobian of difference fluxes on a grid
+(a discrete Laplacian), in O(n) work by smoothed aggregation multigrid:
+	the unknowns are agglomerated into aggregates, the aggregates of
+		one level being the unknowns of the next, coarser, level
+	the prolongation P from the coarse level is the aggregates'
+		indicator, smoothed by one damped Jacobi step
+	the coarse matrix is P^T J P
+	each V-cycle smooths with damped Jacobi, corrects from the coarse
+		level and smooths again, and the coarsest level is solved directly
+The V-cycle preconditions GMRES, as in newton.linearSolve.
+
+Building the levels costs more than the V-cycles, so solve can keep
+them in a cache between calls (eg. the Newton iterations of a solve).
+The kept levels precondition later matrices as well, and are only built
+again when GMRES does not converge with them.
+
+On structured grids (grid.py) the aggregates are the 2 x 2 blocks
+of cells of each state, found from the shapes alone. Otherwise they
+are grown greedily over the matrix graph, each aggregate being an
+unknown and its neighbours not yet aggregated.
+
+------------------------------------
+function tests are run by doctest
+python multigrid.py
+------------------------------------
+>>> n = 64
+>>> T = sp.diags([1.,-2.,1.],[-1,0,1],shape=(n,n))
+>>> J = sp.csr_matrix(sp.kron(T,sp.identity(n)) + sp.kron(sp.identity(n),T))
+>>> b = np.ones(n*n)
+>>> levels = hierarchy(J,[(n,n)],coarsest = 64)
+>>> len(levels)
+4
+>>> x = solve(J,b,[(n,n)],tol = 1e-10)
+>>> np.linalg.norm(J.dot(x) - b) < 1e-8*np.linalg.norm(b)
+True
+>>> x = solve(J,b,tol = 1e-10)
+>>> np.linalg.norm(J.dot(x) - b) < 1e-8*np.linalg.norm(b)
+True
+>>> cache = {}
+>>> x = solve(J,b,[(n,n)],1e-10,cache)
+>>> levels = cache['levels']
+>>> x = solve(1.1*J,b,[(n,n)],1e-10,cache)
+>>> cache['levels'] is levels, np.linalg.norm(1.1*J.dot(x) - b) < 1e-8*np.linalg.norm(b)
+(True, True)
+"""
+import warnings
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+"""
+structured:		2 x 2 aggregates of cells on structured grids
+
+input(s):   (shapes) list of (n,m), the shapes of the 2-D blocks of
+								unknowns, in order, each row-major
+output(s):	(agg) the aggregate of each unknown
+						(shapes) the shapes of the coarse blocks
+"""
+def structured(shapes):
+	agg = []
+	coarse = []
+	offset = 0
+	for (n,m) in shapes:
+		(nc,mc) = ((n+1)/2,(m+1)/2)
+		(i,j) = np.indices((n,m))
+		agg.append(offset + (i/2)*mc + j/2)
+		coarse.append((nc,mc))
+		offset += nc*mc
+	return np.concatenate([a.ravel() for a in agg]), coarse
+
+"""
+aggregate:		greedy aggregation over the graph of a matrix
+
+input(s):   (A) sparse matrix
+output(s):	the aggregate of each unknown
+"""
+def aggregate(A):
+	A = sp.csr_matrix(A)
+	n = A.shape[0]
+	agg = -np.ones(n,dtype=int)
+	count = 0
+	# first pass, roots with all their neighbours free
+	for i in range(n):
+		neighbours = A.indices[A.indptr[i]:A.indptr[i+1]]
+		if agg[i] < 0 and (agg[neighbours] < 0).all():
+			agg[neighbours] = count
+			agg[i] = count
+			count += 1
+	# second pass, the rest join a neighbouring aggregate
+	for i in np.flatnonzero(agg < 0):
+		neighbours = A.indices[A.indptr[i]:A.indptr[i+1]]
+		joined = agg[neighbours][agg[neighbours] >= 0]
+		if len(joined):
+			agg[i] = joined[0]
+		else:
+			agg[i] = count
+			count += 1
+	return agg
+
+def jacobi(A):
+	""" the inverse diagonal of A, damped by 4/3 of its Gershgorin spectral radius bound """
+	D = A.diagonal()
+	D[D == 0.] = 1.
+	# the largest row sum of |D^-1 A|, without forming D^-1 A
+	rho = np.max(np.ravel(abs(A).sum(axis=1))/abs(D))
+	return (4./3./rho)/D
+
+"""
+hierarchy:		builds the multigrid levels of A
+
+input(s):   (A) sparse matrix
+						(shapes) structured grid shapes, see structured, or None
+						(coarsest) size of the coarsest level, solved directly
+output(s):	list of levels, dicts of the matrix A, the prolongation P to it
+						from the next level and the restriction R = P^T from it,
+						the damped inverse diagonal D, and
+						for the coarsest level, its LU factors
+"""
+def hierarchy(A,shapes = None,coarsest = 1000):
+	A = sp.csr_matrix(A)
+	levels = []
+	while True:
+		level = {'A':A,'D':jacobi(A)}
+		levels.append(level)
+		if A.shape[0] <= coarsest:
+			break
+		if shapes is not None:
+			(agg,shapes) = structured(shapes)
+		else:
+			agg = aggregate(A)
+		nc = agg.max()+1
+		if nc >= A.shape[0]:
+			break
+		P0 = sp.csr_matrix((np.ones(A.shape[0]),(np.arange(A.shape[0]),agg)),shape=(A.shape[0],nc))
+		# D A P0, scaling the rows of A P0 in place
+		AP0 = sp.csr_matrix(A.dot(P0))
+		AP0.data *= np.repeat(level['D'],np.diff(AP0.indptr))
+		P = sp.csr_matrix(P0 - AP0)
+		level['P'] = P
+		# the restriction, kept as csr rather than the transpose's csc
+		level['R'] = sp.csr_matrix(P.T)
+		A = sp.csr_matrix(level['R'].dot(A.dot(P)))
+	levels[-1]['lu'] = spla.splu(sp.csc_matrix(levels[-1]['A']))
+	return levels
+
+"""
+vcycle:			one V-cycle on A x = b from x = 0
+
+input(s):   (levels) from hierarchy
+						(b) right hand side
+						(k) level to start from
+						(sweeps) Jacobi sweeps before and after the coarse correction
+output(s):	approximate solution x
+"""
+def vcycle(levels,b,k = 0,sweeps = 2):
+	level = levels[k]
+	if 'lu' in level:
+		return level['lu'].solve(b)
+	(A,D,P,R) = (level['A'],level['D'],level['P'],level['R'])
+	x = D*b
+	for i in range(sweeps-1):
+		x += D*(b - A.dot(x))
+	x += P.dot(vcycle(levels,R.dot(b - A.dot(x)),k+1,sweeps))
+	for i in range(sweeps):
+		x += D*(b - A.dot(x))
+	return x
+
+"""
+solve:			solves A x = b with multigrid preconditioned GMRES
+
+input(s):   (A) sparse matrix
+						(b) right hand side
+						(shapes) structured grid shapes, or None
+						(tol) relative tolerance
+						(cache) optional dict keeping the levels between calls
+output(s):	x, array of floats
+
+the levels in cache are used if there are any, and built again from A
+if GMRES does not converge with them. GMRES breaking down raises
+RuntimeError, and not converging with levels just built warns
+"""
+def solve(A,b,shapes = None,tol = 1e-8,cache = None):
+	cache = {} if cache is None else cache
+	kept = 'levels' in cache and cache['levels'][0]['A'].shape == A.shape
+	while True:
+		if not kept:
+			cache['levels'] = hierarchy(A,shapes)
+		levels = cache['levels']
+		M = spla.LinearOperator(A.shape,lambda r: vcycle(levels,r),dtype=float)
+		# a V-cycle preconditioned GMRES converges in a few tens of
+		# iterations, and the Krylov basis is kept small on large grids
+		x, info = spla.gmres(A,b,tol = tol,atol = 0.,restart = 20,M = M)
+		if info < 0:
+			raise RuntimeError('GMRES broke down, info ' + str(info))
+		if info == 0 or not kept:
+			break
+		kept = False
+	if info > 0:
+		warnings.warn('GMRES did not reach tol in ' + str(info) + ' iterations',RuntimeWarning)
+	return x
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
@@ -0,0 +1,239 @@
+"""
+newton.py contains the sparse Newton solver
+
+Solves R(U) = 0 by inexact Newton iterations
+	J(U) dU = -R(U),  U <- U + a dU
+where J is a scipy.sparse Jacobian (see jacobian.py), the linear
+system is solved either directly (SuperLU) or by a Krylov method
+(GMRES/BiCGSTAB) preconditioned with an incomplete LU, and the step
+length a is found with a backtracking line search.
+
+J can also be matrix-free (see jacobianFree), only giving the products
+J v, by finite differences of R, for the Krylov methods. A Krylov
+method that does not reach its tolerance warns, which near the root
+of a matrix-free system is expected, the finite differences limiting
+how far it can go, while Newton still converges.
+
+The iterations stop without converging when the line search cannot 
+reduce the residual, the last step being rejected. Not converging only
+warns, as fsolve, so callers check info['converged'].
+
+------------------------------------
+function tests are run by doctest
+python newton.py
+------------------------------------
+>>> r = lambda x: np.array([x[0]**2 + x[1] - 3., x[0] + x[1]**3 - 9.])
+>>> J = lambda x: sp.csr_matrix([[2*x[0], 1.],[1., 3*x[1]**2]])
+>>> x, info = newton(r,[1.,1.],J)
+>>> np.round(x,8)
+array([1., 2.])
+>>> info['converged']
+True
+>>> x, info = newton(r,[1.,1.],J,linear = 'gmres')
+>>> np.round(x,8)
+array([1., 2.])
+>>> import warnings
+>>> warnings.simplefilter('ignore')
+>>> x, info = newton(r,[1.,1.],lambda x: jacobianFree(r,x,ilu(J([1.,1.]))),linear = 'gmres')
+>>> np.round(x,8)
+array([1., 2.])
+>>> x, info = newton(lambda x: x**2 + 1.,[1.],lambda x: sp.csr_matrix([[-2*x[0]]]))
+>>> info['converged'], info['message']
+(False, 'the line search could not reduce the residual')
+>>> r2 = lambda x: np.array([x[0]**2 - 4., x[1]**2 + 1.])
+>>> x, info = newton(r2,[1.,1.],lambda x: sp.diags([2*x[0],-2*x[1]]),groups = [0,1])
+>>> np.round(x,8), info['rows']
+(array([2., 1.]), array([ True, False]))
+>>> r3 = lambda x: np.array([x[0]**2 - 4., np.nan*x[1]])
+>>> x, info = newton(r3,[1.,1.],lambda x: sp.diags([2*x[0],np.nan]),groups = [0,1])
+>>> np.round(x,8), info['rows']
+(array([2., 1.]), array([ True, False]))
+"""
+import warnings
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+
+"""
+ilu:				incomplete LU preconditioner of a sparse matrix
+
+input(s):   (J) sparse matrix
+output(s):	LinearOperator applying the inverse of the incomplete factors,
+							or None if the factors are singular
+"""
+def ilu(J):
+	try:
+		factors = spla.spilu(sp.csc_matrix(J),drop_tol = 1e-4,fill_factor = 10)
+	except RuntimeError:
+		return None
+	return spla.LinearOperator(J.shape,factors.solve,dtype=float)
+
+"""
+jacobianFree:	matrix-free Jacobian of r at x
+
+input(s):   (r) residual function r(x)
+						(x) array of floats
+						(M) optional preconditioner, kept as .M
+output(s):	LinearOperator, J v = (r(x + h v) - r(x))/h
+
+each product costs one residual evaluation, with h scaled to x and v
+"""
+def jacobianFree(r,x,M = None):
+	x = np.array(x,dtype=float)
+	R = np.array(r(x),dtype=float)
+	def product(v):
+		v = np.ravel(v)
+		nv = np.linalg.norm(v)
+		if nv == 0.:
+			return np.zeros(len(R))
+		h = np.sqrt(np.finfo(float).eps)*max(np.linalg.norm(x),1.)/nv
+		return (np.array(r(x + h*v),dtype=float) - R)/h
+	J = spla.LinearOperator((len(R),len(x)),matvec = product,dtype=float)
+	J.M = M
+	return J
+
+"""
+linearSolve:	solves J dx = b
+
+input(s):   (J) sparse matrix, or LinearOperator from jacobianFree
+						(b) right hand side
+						(linear) 'splu', 'gmres' or 'bicgstab'
+						(tol) relative tolerance for the Krylov methods
+output(s):	dx, array of floats, warns if a Krylov method did not reach tol
+						and raises RuntimeError if it broke down
+"""
+def linearSolve(J,b,linear = 'splu',tol = 1e-8):
+	if callable(linear):
+		return linear(J,b,tol)
+	if isinstance(J,spla.LinearOperator):
+		if linear == 'splu':
+			raise ValueError('a matrix-free Jacobian needs a Krylov linear solver')
+		M = J.M
+	elif linear == 'splu':
+		return spla.splu(sp.csc_matrix(J)).solve(b)
+	else:
+		M = ilu(J)
+	if linear == 'gmres':
+		dx, info = spla.gmres(J,b,tol = tol,atol = 0.,restart = 50,M = M)
+	elif linear == 'bicgstab':
+		dx, info = spla.bicgstab(J,b,tol = tol,atol = 0.,M = M)
+	else:
+		raise ValueError('unknown linear solver ' + str(linear))
+	if info < 0:
+		raise RuntimeError(linear + ' broke down, info ' + str(info))
+	if info > 0:
+		warnings.warn(linear + ' did not reach tol in ' + str(info) + ' iterations',RuntimeWarning)
+	return dx
+
+"""
+restrict:		the Jacobian of the unknowns kept, with the others left alone
+
+input(s):   (J) sparse matrix, dense array, or LinearOperator from jacobianFree
+						(keep) boolean array, the unknowns still being solved for
+output(s):	J with the rows and columns of the other unknowns replaced
+						by those of the identity, a csr matrix for a sparse J,
+						and otherwise of the same type and shape
+
+for independent groups of unknowns, so that a group that has stopped,
+or whose residual is not a number, does not spoil the steps of the others
+"""
+def restrict(J,keep):
+	if isinstance(J,spla.LinearOperator):
+		product = lambda v: np.where(keep,J.matvec(np.where(keep,np.ravel(v),0.)),np.ravel(v))
+		K = spla.LinearOperator(J.shape,matvec = product,dtype=float)
+		K.M = J.M
+		return K
+	if isinstance(J,np.ndarray):
+		return np.where(np.outer(keep,keep),J,0.) + np.diag(~keep)
+	C = sp.coo_matrix(J)
+	k = keep[C.row] & keep[C.col]
+	return sp.csr_matrix((C.data[k],(C.row[k],C.col[k])),shape=J.shape) + sp.diags((~keep).astype(float))
+
+"""
+newton:			inexact Newton with a backtracking line search
+
+input(s):   (r) residual function r(x)
+						(x0) initial guess
+						(jac) Jacobian function jac(x), returning a sparse matrix
+							or a matrix-free LinearOperator (jacobianFree)
+						(linear) linear solver, see linearSolve
+						(tol) absolute tolerance on the residual 2-norm
+						(rtol) tolerance relative to the initial residual 2-norm
+						(maxiter) maximum number of Newton iterations
+						(eta) Krylov forcing term, the linear solve only reduces
+							the linear residual by this factor. It is tightened
+							as the Newton iterations converge
+						(groups) optional group of each unknown, for systems
+							of independent groups (eg. the operating points of a
+							batch). Each group then has its own norm, target and
+							line search, and stops on its own
+output(s):	(x) solution, or the last accepted iterate
+						(info) dict with the iterations, residual and jacobian
+							evaluations, final residual norm, the norm to reach
+							(target), convergence flag and a message if not
+							converged, and the last Jacobian if one was computed.
+							With groups, also the final norm of each group (norms)
+							and whether it converged (rows)
+"""
+def newton(r,x0,jac,linear = 'splu',tol = 1e-10,rtol = 1e-12,maxiter = 50,eta = 1e-2,groups = None):
+	x = np.array(x0,dtype=float)
+	g = np.zeros(len(x),dtype=int) if groups is None else np.asarray(groups)
+	ng = g.max()+1 if len(g) else 1
+	norms = lambda R: np.sqrt(np.bincount(g,R**2,minlength = ng))
+	R = np.array(r(x),dtype=float)
+	N = norms(R)
+	target = np.maximum(tol,rtol*N)
+	done = N <= target
+	# nothing to do for a residual that is not a number
+	failed = ~np.isfinite(N)
+	info = {'iterations':0,'nfev':1,'njev':0,'converged':False}
+	for it in range(maxiter):
+		active = ~(done | failed)
+		if not active.any():
+			break
+		J = jac(x)
+		info['njev'] += 1
+		info['jacobian'] = J
+		b = -R
+		if not active.all():
+			keep = active[g]
+			J = restrict(J,keep)
+			b = np.where(keep,b,0.)
+		dx = linearSolve(J,b,linear,min(eta,np.linalg.norm(b)))
+		# backtrack each group until its residual norm decreases
+		# sufficiently, and give it up, keeping its x, if it does not
+		# for any step
+		a = active.astype(float)
+		searching = active.copy()
+		while True:
+			xa = x + a[g]*dx
+			Ra = np.array(r(xa),dtype=float)
+			info['nfev'] += 1
+			Na = norms(Ra)
+			searching &= ~(Na <= (1. - 1e-4*a)*N)
+			if not searching.any():
+				break
+			a[searching] *= 0.5
+			stuck = searching & (a < 1e-4)
+			failed |= stuck
+			searching &= ~stuck
+			a[stuck] = 0.
+		x, R, N = xa, Ra, Na
+		done = N <= target
+		info['iterations'] = it + 1
+	info['converged'] = bool(done.all())
+	info['norm'] = np.linalg.norm(R)
+	info['target'] = target[0] if groups is None else target
+	if groups is not None:
+		info['norms'] = N
+		info['rows'] = done
+	if not info['converged']:
+		info['message'] = 'the line search could not reduce the residual' if failed.any() \
+			else 'the maximum number of iterations was reached'
+		warnings.warn('Newton did not converge, residual norm ' + str(info['norm']) + ', ' + \
+			info['message'],RuntimeWarning)
+	return x, info
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
@@ -2,15 +2,132 @@
 problem.py contains the Problem Class
 
 Each Problem has:
-	(.b) the blocks to solve for in the problem
+	(.b) the blocks to solve for in the problem, 
+		which can include structured grids (grid.py)
 	(.bc) the blocks used as boundary blocks
 	(.mapping) the mapping between the local and global systems
+	(.bcmapping) the mapping of the boundary block states
+	(.boundary) optional function of time driving all the boundary
+		states at once, ordered as bcmapping, see drive
+	(.array) whether the problem is array-backed, in which case
+		(.x) is the global state array that the block states view into
+		(.res) is the preallocated global residual array
+		(.xbc) is the array the boundary block states view into
+	(.batch) the number of operating points solved at once, or None.
+		In a batch every state is an array with one entry per operating point,
+		.x has one row per mapping entry, and the global system is the 
+		flattened .x, block diagonal over the operating points
+	(.pattern) the sparsity pattern of the Jacobian, from the fluxes
+	(.colors) the column groups used to compute the Jacobian
+	(.levels) None, or after triangulate() the strongly connected
+		components of the flux dependency graph, grouped in levels
+		that can be solved in turn, see triangulate
+	(.info) the info dict of the last solve, see newton.py, for fsolve
+		the residual and jacobian evaluations, final residual norm,
+		convergence flag and message. For a batch, also the residual
+		norm of each operating point (norms), and whether it converged (rows)
+	(.stats) None, or the instrumentation collected since instrument(),
+		call counts and wall times of the residual, the Jacobian and
+		each flux and source kernel, and the info of the last solve
+	(.parameters) declared model parameters, inputs that can be 
+		rebound between solves without rebuilding the blocks
+	(.sites) None, or after locate() the positioned blocks and grid cells,
+		as (block, cell) pairs, cell being None for a block or (i,j) for a grid
+	(.tree) the KD-tree over the positions of the sites
 
 
 ------------------------------------
 function tests are run by doctest
 python problem.py
 ------------------------------------
+>>> import blocks, flux, source
+>>> a = blocks.Block('a',None,u = 1.)
+>>> c = blocks.Block('c',None,u = 0.)
+>>> c.addFlux(flux.Flux(a,'difference',{'d':1.,'m':[]}))
+>>> c.addSource(source.Source('const',u = 2.))
+>>> P = Problem([c],array = True)
+>>> P.instrument()
+>>> P.solve('newton-sparse')
+>>> c.state['u']
+3.0
+>>> P.stats['solve']['iterations'], P.stats['jacobian']['calls']
+(1, 1)
+>>> P.stats['fluxes']['difference']['calls'] == P.stats['residual']['calls']
+True
+>>> P.instrument(False)
+>>> P.stats is None
+True
+>>> P.declare('q',lambda: c.S[0].p['u'],lambda v: c.S[0].p.__setitem__('u',v))
+>>> P.declare('a',lambda: a.state['u'],lambda v: a.state.__setitem__('u',v))
+>>> np.round(P.sensitivities(['q','a']),6)
+array([[1., 1.]])
+>>> np.round(P.sensitivities(['q','a'],[[2.]]),6)
+array([[2., 2.]])
+
+>>> B = [blocks.Block(str(i),None,u = 0.) for i in range(4)]
+>>> B[0].state['u'] = 1.
+>>> for i in range(1,4):
+... 	B[i].addFlux(flux.Flux(B[i-1],'difference',{'d':1.,'m':[]}))
+... 	B[i].addSource(source.Source('const',u = 1.))
+>>> P = Problem(B[1:],array = True)
+>>> [L['rows'].tolist() for L in P.triangulate()]
+[[0], [1], [2]]
+>>> P.solve('newton-triangular')
+>>> P.getSolution()
+array([2., 3., 4.])
+>>> B[1].S[0].p['u'] = np.nan
+>>> import warnings
+>>> with warnings.catch_warnings():
+... 	warnings.simplefilter('ignore')
+... 	P.solve('newton-triangular')
+>>> P.info['converged'], P.info['level']
+(False, 0)
+>>> B = [blocks.Block(str(i),None,u = np.array([i + 1.,0.])) for i in range(4)]
+>>> B[0].state['u'] = np.array([1.,1.])
+>>> for i in range(1,4):
+... 	B[i].addFlux(flux.Flux(B[i-1],'difference',{'d':1.,'m':[]}))
+... 	B[i].addSource(source.Source('const',u = 1.))
+>>> P = Problem(B[1:],array = True,batch = 2)
+>>> P.solve('newton-triangular')
+>>> np.round(P.x,8), P.info['rows']
+(array([[2., 2.],
+       [3., 3.],
+       [4., 4.]]), array([ True,  True]))
+
+>>> B = [blocks.Block(str(i),None,u = float(i)) for i in range(4)]
+>>> for i,b in enumerate(B):
+... 	b.position = (float(i),0.)
+>>> P = Problem(B,array = True)
+>>> P.locate()
+>>> d, j = P.nearest([[2.2,0.],[0.,1.]])
+>>> [P.sites[i][0].name for i in j]
+['2', '0']
+>>> sorted(P.sites[i][0].name for i in P.region([1.5,0.],0.6))
+['1', '2']
+>>> W = P.sampler([[1.5,0.],[3.,0.]],'u',k = 2)
+>>> W.dot(P.x)
+array([1.5, 3. ])
+
+>>> import tempfile, shutil
+>>> folder = tempfile.mkdtemp()
+>>> out = os.path.join(folder,'chain.npy')
+>>> B = [blocks.Block(str(i),None,u = 0.) for i in range(3)]
+>>> B[0].state['u'] = 1.
+>>> for i in range(1,3):
+... 	B[i].addFlux(flux.Flux(B[i-1],'difference',{'d':1.,'m':[]}))
+>>> P = Problem(B[1:],array = True)
+>>> soln = P.solveUnst(0,2,5,out = out)
+>>> t, labels, trajectory = loadTrajectory(out)
+>>> t, labels, trajectory.shape
+(array([0. , 0.5, 1. , 1.5, 2. ]), ['1:u', '2:u'], (5, 2))
+>>> np.array_equal(trajectory[-1],P.getSolution()), np.array_equal(trajectory,soln)
+(True, True)
+>>> P.update(np.zeros(2))
+>>> soln = P.solveUnst(0,2,5,out = out,method = 'BDF',rtol = 1e-10,atol = 1e-12)
+>>> np.abs(loadTrajectory(out)[2] - trajectory).max() < 1e-8
+True
+>>> del soln, trajectory
+>>> shutil.rmtree(folder)
 """
 
 
@@ -20,7 +137,21 @@ ode is used for solving transient
 """
 from scipy.optimize import fsolve
 from scipy.integrate import odeint
+import scipy.integrate as integrate
+import os
+import time
+import warnings
+import scipy.sparse as sp
+import scipy.sparse.csgraph as csgraph
+import scipy.sparse.linalg as spla
+import scipy.spatial as spatial
 import numpy as np
+import jacobian
+import newton
+import multigrid
+import decompose
+import grid
+import source
 class Problem(object):
 	""" 
 	Problem Class
@@ -30,12 +161,280 @@ class Problem(object):
 	input(s):   (blocks) relevant blocks
 							(boundaries) blocks on the boundaries
 								these are needed for unsteady problems
+							(parameters) optional keyword arguments
+								array = True binds the block states to one
+								global array, and assembles the residual into
+								a preallocated array
+								batch = n solves n operating points at once,
+								the inputs (boundary states, sources) can then be
+								arrays of length n. This implies array = True
 	output(s):	None
 	"""
 	def __init__(self,blocks,boundaries = [],**parameters):
 		self.b = blocks
 		self.bc = boundaries
-		self.mapping = [(i, k) for i, b in enumerate(blocks) for k in b.state.keys()]
+		self.mapping = [(i, k) for i, b in enumerate(blocks) for k in b.labels()]
+		self.bcmapping = [(i, k) for i, bc in enumerate(boundaries) for k in bc.labels()]
+		self.boundary = None
+		# structured grids only exist as arrays
+		self.grids = [b for b in blocks if isinstance(b,grid.Grid)]
+		self.batch = parameters.get('batch',None)
+		if self.grids and self.batch is not None:
+			raise ValueError('grids hold one value per cell, and cannot be solved in a batch')
+		self.array = parameters.get('array',False) or len(self.grids) > 0 \
+			or self.batch is not None
+		self.pattern = None
+		self.colors = None
+		self.levels = None
+		self.info = None
+		self.stats = None
+		self.sites = None
+		self.tree = None
+		self.parameters = {}
+		# flux constants, now that the blocks are finished
+		for b in self.b:
+			for F in b.F:
+				F.setup()
+		if self.array:
+			shape = len(self.mapping) if self.batch is None else (len(self.mapping),self.batch)
+			self.x = np.zeros(shape)
+			self.res = np.zeros(shape)
+			offset = 0
+			for b in self.b:
+				b.bind(self.x,offset)
+				offset += len(b.labels())
+			shape = len(self.bcmapping) if self.batch is None else (len(self.bcmapping),self.batch)
+			self.xbc = np.zeros(shape)
+			offset = 0
+			for bc in self.bc:
+				bc.bind(self.xbc,offset)
+				offset += len(bc.labels())
+
+	"""
+	declare:		declares a model parameter
+
+	input(s):   (name) parameter name
+							(get) function returning the parameter's value
+							(set) function setting the parameter's value, 
+								eg. writing a boundary block state or a source value
+	output(s):	None
+	"""
+	def declare(self,name,get,set):
+		self.parameters[name] = (get,set)
+
+	"""
+	setParameters:	rebinds declared parameters
+	getParameter:		returns the value of a declared parameter
+
+	input(s):   (values) key-value pairs of parameter names and values
+							(name) parameter name
+	output(s):	None, value of the parameter
+	"""
+	def setParameters(self,**values):
+		for name, v in values.iteritems():
+			self.parameters[name][1](v)
+
+	def getParameter(self,name):
+		return self.parameters[name][0]()
+
+	"""
+	sensitivities:	derivatives of the converged solution with respect
+									to declared parameters
+
+	input(s):   (names) declared parameter names
+							(outputs) optional matrix W, the outputs being W times
+								the global solution, eg. from sampler
+							(t) time
+	output(s):	dx/dp, one column per parameter, or dy/dp = W dx/dp
+
+	at a converged solution R(x(p),p) = 0, so J dx/dp = -dR/dp, where
+	dR/dp is a central difference of the residual for each parameter
+	and J is factored once. Each parameter then costs one (tangent) solve,
+	or with outputs, each output costs one adjoint solve, J^T l = w,
+	whichever is fewer. In a batch, a parameter is perturbed at every
+	operating point at once, each only moving its own states
+	"""
+	def sensitivities(self,names,outputs = None,t = 0):
+		x = self.getSolution()
+		lu = spla.splu(sp.csc_matrix(self.jacobian(x,t)))
+		dR = np.zeros((len(x),len(names)))
+		for j,name in enumerate(names):
+			# a copy, as a parameter can be a view of the states
+			p = self.getParameter(name)
+			p = np.array(p,dtype=float) if np.ndim(p) else float(p)
+			h = 1e-6*max(np.max(np.abs(p)),1.)
+			self.setParameters(**{name:p + h})
+			dR[:,j] = self.r(x,t)
+			self.setParameters(**{name:p - h})
+			dR[:,j] -= self.r(x,t)
+			self.setParameters(**{name:p})
+			dR[:,j] /= 2.*h
+		self.update(x,t)
+		if outputs is None:
+			return -lu.solve(dR)
+		W = sp.csr_matrix(outputs)
+		if W.shape[0] < len(names):
+			L = lu.solve(W.T.toarray(),trans = 'T')
+			return -L.T.dot(dR)
+		return -W.dot(lu.solve(dR))
+
+	"""
+	drive:			drives every boundary state with one vectorized function
+
+	input(s):   (boundary) function of time returning the states of all the
+								boundary blocks at once, as an array ordered as bcmapping
+								(with a column per operating point in a batch)
+	output(s):	None
+
+	the boundary update is then a single array write per residual,
+	rather than a source call for each boundary block
+	"""
+	def drive(self,boundary):
+		self.boundary = boundary
+
+	"""
+	tabulate:		drives the boundary states from a table of their sources
+
+	input(s):   (times) times to evaluate the boundary block sources at
+	output(s):	None
+
+	the sources are evaluated once at each time, and the boundary states
+	are then linearly interpolated from the table, see source.table
+	"""
+	def tabulate(self,times):
+		self.boundary = None
+		values = []
+		for t in times:
+			self.update(self.getSolution(),t)
+			values.append(np.array([self.bc[i].state[k] for i,k in self.bcmapping]))
+		self.drive(source.table(times,values))
+
+	"""
+	locate:			builds the spatial index over the positioned blocks and grid cells
+
+	input(s):   None
+	output(s):	None
+
+	blocks without a .position, and grids without one, are left out
+	"""
+	def locate(self):
+		self.sites = []
+		points = []
+		for b in self.b:
+			position = getattr(b,'position',None)
+			if position is None:
+				continue
+			if isinstance(b,grid.Grid):
+				for (i,j) in np.ndindex(*b.shape):
+					self.sites.append((b,(i+1,j+1)))
+				points.append(np.column_stack([np.ravel(X) for X in position]))
+			else:
+				self.sites.append((b,None))
+				points.append(np.atleast_2d(np.asarray(position,dtype=float)))
+		if not points:
+			raise ValueError('no block has a position')
+		self.tree = spatial.cKDTree(np.concatenate(points))
+
+	"""
+	nearest:		the sites nearest to some points
+	region:			the sites within a distance of a point
+
+	input(s):   (points) array of coordinates, one row per point
+							(center, r) center and radius of the region
+							(k) number of nearest sites to return for each point
+	output(s):	(distances, sites) indices into .sites, as cKDTree.query
+							list of indices into .sites
+	"""
+	def nearest(self,points,k = 1):
+		if self.tree is None:
+			self.locate()
+		return self.tree.query(np.asarray(points,dtype=float),k)
+
+	def region(self,center,r):
+		if self.tree is None:
+			self.locate()
+		return self.tree.query_ball_point(np.asarray(center,dtype=float),r)
+
+	"""
+	sampler:		interpolation of a state at many points
+
+	input(s):   (points) array of coordinates, one row per sensor
+							(state) state to sample
+							(k) number of nearest sites interpolated between
+	output(s):	sparse matrix W, W.dot(x) are the values at the points,
+							for x a global solution, a row of a trajectory, or .x
+
+	inverse distance weighting of the k nearest sites, built once
+	so the sensors are sampled at every time step by one product
+	"""
+	def sampler(self,points,state,k = 4):
+		if self.tree is None:
+			self.locate()
+		index = {}
+		for ix, (i,label) in enumerate(self.mapping):
+			index[(id(self.b[i]),label)] = ix
+		# global index of the state at each site
+		column = []
+		for (b,cell) in self.sites:
+			label = state if cell is None else (state,) + cell
+			column.append(index.get((id(b),label),-1))
+		column = np.array(column)
+		has = np.flatnonzero(column >= 0)
+		tree = spatial.cKDTree(self.tree.data[has])
+		points = np.atleast_2d(np.asarray(points,dtype=float))
+		k = min(k,len(has))
+		(d,j) = tree.query(points,k)
+		(d,j) = (d.reshape(len(points),k),j.reshape(len(points),k))
+		w = 1./np.maximum(d,1e-300)
+		# exact hits take the site's value
+		exact = d[:,0] == 0.
+		w[exact] = 0.
+		w[exact,0] = 1.
+		w /= w.sum(axis=1)[:,None]
+		rows = np.repeat(np.arange(len(points)),k)
+		return sp.csr_matrix((w.ravel(),(rows,column[has][j.ravel()])), \
+			shape=(len(points),len(self.mapping)))
+
+	"""
+	instrument:	turns the instrumentation on or off
+
+	input(s):   (on) True to start collecting .stats afresh, False to stop
+	output(s):	None
+
+	the residual, the Jacobian and every flux and source function are
+	wrapped with timers, so nothing is timed or counted while it is off.
+	Times are inclusive, the residual time includes the kernels, and the
+	Jacobian time includes its residual evaluations, which are also counted
+	"""
+	def instrument(self,on = True):
+		kernels = [(F,'F','fluxes',F.f) for b in self.b for F in b.F] + \
+			[(S,'S','sources',S.s) for b in self.b + self.bc for S in b.S] + \
+			[(g,'residual','fluxes','grid') for g in self.grids]
+		# take off any timers first
+		for (o,attr,kind,name) in kernels:
+			if hasattr(getattr(o,attr),'wrapped'):
+				setattr(o,attr,getattr(o,attr).wrapped)
+		for attr in ['r','jacobian']:
+			self.__dict__.pop(attr,None)
+		self.stats = None
+		if not on:
+			return
+		self.stats = {'fluxes':{},'sources':{},'solve':{}}
+		for (o,attr,kind,name) in kernels:
+			if not hasattr(getattr(o,attr),'wrapped'):
+				setattr(o,attr,timer(getattr(o,attr),self.stats[kind],name))
+		self.r = timer(self.r,self.stats,'residual')
+		self.jacobian = timer(self.jacobian,self.stats,'jacobian')
+
+	"""
+	decompose:	splits the problem into subdomains, each evaluated
+							in its own worker process, see decompose.py
+
+	input(s):   (k) number of subdomains, defaults to the number of cores
+	output(s):	decompose.Domain, to solve with and close when done
+	"""
+	def decompose(self,k = None):
+		return decompose.Domain(self,k)
 
 	"""
 	update:			Updates the blocks by unwrapping the new solution
@@ -45,43 +444,328 @@ class Problem(object):
 	"""
 
 	def update(self,solution,t = 0):
-		for ix, (i,k) in enumerate(self.mapping):
-			self.b[i].state[k] = solution[ix]
+		if self.array:
+			if solution is not self.x:
+				self.x[:] = np.reshape(solution,self.x.shape)
+			for g in self.grids:
+				g.t = t
+				g.sync()
+		else:
+			for ix, (i,k) in enumerate(self.mapping):
+				self.b[i].state[k] = solution[ix]
 		# update time	
 		for b in self.b:	
 			b.t = t
 		# BC states are updated using a single source function to drive them	
 		for bc in self.bc:
 			bc.t = t
+		if self.boundary is not None:
+			if self.array:
+				self.xbc[:] = self.boundary(t)
+			else:
+				for v, (i,k) in zip(self.boundary(t),self.bcmapping):
+					self.bc[i].state[k] = v
+			return
+		for bc in self.bc:
+			S = bc.S[0].S(bc)
 			for s in bc.state:
-				bc.state[s] = bc.S[0].S(bc)[s]
+				bc.state[s] = S[s]
 
 	"""
 	r:					Global residual function r(solution) 
 
 	input(s):    (solution) global array of floats corresponding to mapping
+							 (t) time
+							 (out) optional array to write the residual into,
+							 	when array-backed
 	output(s):	R(solution) global array of floats corresponding to residual
 
 	updates solution first, then computes
 	should be passed into another function
+
+	when array-backed, the residual is assembled into self.res,
+	and a copy is returned unless out is given, as solvers 
+	like fsolve hold on to the first array they are handed
 	"""
-	def r(self,solution,t = 0):
+	def r(self,solution,t = 0,out = None):
 		self.update(solution,t)
+		if self.array:
+			for b in self.b:
+				b.residual(self.res)
+			if out is None:
+				return self.res.flatten()
+			out[:] = self.res.ravel()
+			return out
 		return [self.b[i].R()[v] for i,v in self.mapping]
 
 	"""
-	solve:			wrapper for chosen (non)linear solver
+	getSolution:	wraps the block states into a global array
 
 	input(s):   None
+	output(s):	global array of floats corresponding to mapping
+	"""
+	def getSolution(self):
+		if self.array:
+			return self.x.flatten()
+		return np.array([self.b[i].state[k] for i,k in self.mapping],dtype=float)
+
+	"""
+	sparsity:		Jacobian sparsity pattern from the flux connectivity
+
+	input(s):   None
+	output(s):	sparse boolean matrix, entry (ix,jx) is nonzero
+							if residual ix depends on state jx
+
+	each block gives its own rows, see Block.pattern
+	the columns are colored here as well, and for a batch both
+	are repeated for every operating point
+	"""
+	def sparsity(self):
+		if self.pattern is not None:
+			return self.pattern
+		index = {}
+		# grids only couple to themselves, and need no index
+		if len(self.grids) < len(self.b):
+			for ix, (i,k) in enumerate(self.mapping):
+				index.setdefault(id(self.b[i]),{})[k] = ix
+		rows = []
+		cols = []
+		for b in self.b:
+			(r,c) = b.pattern(index)
+			rows.append(np.asarray(r,dtype=int))
+			cols.append(np.asarray(c,dtype=int))
+		rows = np.concatenate(rows)
+		cols = np.concatenate(cols)
+		n = len(self.mapping)
+		self.pattern = sp.csr_matrix((np.ones(len(rows),dtype=bool),(rows,cols)),shape=(n,n))
+		if len(self.grids) == len(self.b):
+			# grids are colored from their stencil, and never couple to each other
+			self.colors = np.concatenate([g.colors() for g in self.grids])
+		else:
+			self.colors = jacobian.color(self.pattern)
+		if self.batch is not None:
+			self.pattern = sp.csr_matrix(sp.kron(self.pattern,sp.identity(self.batch,dtype=bool)))
+			# kron keeps the zeros of small dense blocks, which
+			# would couple the operating points
+			self.pattern.eliminate_zeros()
+			self.colors = np.repeat(self.colors,self.batch)
+		return self.pattern
+
+	"""
+	jacobian:		sparse finite difference Jacobian of r(solution)
+
+	input(s):   (solution) global array of floats corresponding to mapping
+							(t) time
+	output(s):	dR/dU as a scipy.sparse csr_matrix
+
+	the columns are colored once, so each Jacobian costs
+	one residual evaluation per color
+	"""
+	def jacobian(self,solution,t = 0):
+		pattern = self.sparsity()
+		return jacobian.fdJacobian(lambda x: self.r(x,t),solution,pattern,self.colors)
+
+	"""
+	triangulate:	block triangular decomposition of the problem
+
+	input(s):   None
+	output(s):	list of levels, each a dict of the unknowns (rows) it solves
+							for, the blocks owning them, and the sparsity pattern and
+							column colors of its own Jacobian
+
+	the strongly connected components of the dependency graph (a state
+	and the residuals that depend on it) are the blocks of unknowns that
+	must be solved together. Ordered topologically, every component only
+	depends on itself and the components before it, so they can be solved
+	in turn, each from the solutions of those before. A level holds the
+	components whose predecessors are all in earlier levels, which do not
+	depend on each other and are solved at once, their Jacobian being
+	block diagonal
+	"""
+	def triangulate(self):
+		if self.levels is not None:
+			return self.levels
+		nb = 1 if self.batch is None else self.batch
+		pattern = sp.csr_matrix(self.sparsity()[::nb,::nb])
+		(n,label) = csgraph.connected_components(pattern,directed = True,connection = 'strong')
+		# the condensed graph, from each component to those depending on it
+		C = sp.coo_matrix(pattern)
+		between = label[C.row] != label[C.col]
+		D = sp.csr_matrix((np.ones(between.sum()),(label[C.col[between]],label[C.row[between]])),shape=(n,n))
+		# peel the components with no unsolved predecessors, level by level
+		indegree = np.bincount(D.indices,minlength = n)
+		level = -np.ones(n,dtype=int)
+		frontier = np.flatnonzero(indegree == 0)
+		depth = 0
+		while len(frontier):
+			level[frontier] = depth
+			after = np.concatenate([D.indices[D.indptr[c]:D.indptr[c+1]] for c in frontier])
+			indegree -= np.bincount(after,minlength = n)
+			frontier = np.unique(after[indegree[after] == 0])
+			depth += 1
+		block = np.array([i for (i,k) in self.mapping])
+		depths = level[label]
+		order = np.argsort(depths,kind = 'mergesort')
+		sizes = np.bincount(depths,minlength = depth)
+		ends = np.cumsum(sizes)
+		# the dependencies within each level, numbered within the level,
+		# colored all at once as they never share a column across levels
+		within = depths[C.row] == depths[C.col]
+		local = np.empty(len(order),dtype=int)
+		local[order] = np.arange(len(order)) - np.repeat(ends - sizes,sizes)
+		W = sp.csr_matrix((np.ones(within.sum(),dtype=bool),(C.row[within],C.col[within])),shape=pattern.shape)
+		colors = jacobian.color(W)
+		W = sp.coo_matrix(W)
+		entries = np.argsort(depths[W.row],kind = 'mergesort')
+		counts = np.cumsum(np.bincount(depths[W.row],minlength = depth))
+		self.levels = []
+		for d in range(depth):
+			unknowns = order[(ends[d-1] if d else 0):ends[d]]
+			e = entries[(counts[d-1] if d else 0):counts[d]]
+			# repeated for every operating point of a batch
+			(rows,cols) = [(nb*local[a][:,None] + np.arange(nb)).ravel() for a in (W.row[e],W.col[e])]
+			m = nb*len(unknowns)
+			self.levels.append({'rows':(nb*unknowns[:,None] + np.arange(nb)).ravel(), \
+				'blocks':[self.b[i] for i in np.unique(block[unknowns])], \
+				'pattern':sp.coo_matrix((np.ones(len(rows),dtype=bool),(rows,cols)),shape=(m,m)), \
+				'colors':np.repeat(colors[unknowns],nb)})
+		return self.levels
+
+	"""
+	solveTriangular:	Newton solves of the levels of triangulate in turn
+
+	input(s):   (options) passed to newton.newton for each level
+	output(s):	None
+
+	each residual only evaluates the blocks of the level, so a chain
+	of n small components costs n small solves rather than one large one
+
+	the levels after one that does not converge (or has a singular
+	Jacobian) depend on it, so the march stops there, with info['level']
+	and info['message'] saying where and why. In a batch, each operating
+	point converges on its own, and the march goes on while any has
+	"""
+	def solveTriangular(self,**options):
+		if not self.array:
+			raise ValueError('only array-backed problems can be solved by levels')
+		levels = self.triangulate()
+		self.update(self.getSolution())
+		x = self.x.reshape(-1)
+		res = self.res.reshape(-1)
+		nb = self.batch
+		rows = np.ones(1 if nb is None else nb,dtype=bool)
+		self.info = {'iterations':0,'nfev':0,'njev':0,'converged':False,'levels':len(levels)}
+		for d,L in enumerate(levels):
+			grids = [g for g in L['blocks'] if isinstance(g,grid.Grid)]
+			def r(u,L = L,grids = grids):
+				x[L['rows']] = u
+				for g in grids:
+					g.sync()
+				for b in L['blocks']:
+					b.residual(self.res)
+				return res[L['rows']]
+			# small levels are cheaper to solve densely, directly as with splu
+			dense = len(L['rows']) <= 64
+			jac = lambda u,L = L,r = r,dense = dense: \
+				jacobian.fdJacobian(r,u,L['pattern'],L['colors'],dense = dense)
+			local = dict(options)
+			if dense:
+				local['linear'] = lambda J,b,tol: np.linalg.solve(J,b)
+			if nb is not None:
+				local['groups'] = L['rows'] % nb
+			try:
+				u, info = newton.newton(r,x[L['rows']],jac,**local)
+			except (np.linalg.LinAlgError,RuntimeError) as e:
+				rows[:] = False
+				(self.info['level'],self.info['message']) = (d,'singular Jacobian, ' + str(e))
+				warnings.warn('level ' + str(d) + ' has a singular Jacobian',RuntimeWarning)
+				break
+			r(u)
+			for k in ['iterations','nfev','njev']:
+				self.info[k] += info[k]
+			if not info['converged'] and 'level' not in self.info:
+				(self.info['level'],self.info['message']) = (d,info['message'])
+			rows &= info['converged'] if nb is None else info['rows']
+			if not rows.any():
+				break
+		R = self.r(x)
+		self.info['norm'] = np.linalg.norm(R)
+		self.info['converged'] = bool(rows.all())
+		if nb is not None:
+			self.info['norms'] = np.sqrt(np.sum(np.reshape(R,self.x.shape)**2,axis=0))
+			self.info['rows'] = rows
+
+	"""
+	solve:			wrapper for chosen (non)linear solver
+
+	input(s):   (method) 'fsolve' (default), dense MINPACK hybrid method
+								'newton-sparse', Newton with sparse direct (SuperLU) solves
+								'newton-krylov', Jacobian-free Newton with GMRES or
+									BiCGSTAB solves, the Jacobian only being formed once,
+									at the initial guess, for an ILU preconditioner
+								'newton-multigrid', Newton with multigrid preconditioned
+									GMRES solves, see multigrid.py, for difference grids
+								'newton-triangular', Newton solves of each strongly
+									connected component in turn, see triangulate,
+									for array-backed problems
+							(options) passed to newton.newton for the Newton methods,
+								eg. tol, rtol, maxiter, and linear = 'gmres' or 'bicgstab'
 	output(s):	None
 
 	unwraps blocks, passes into solver, finishes by updating blocks one last time
+	the colored sparse Jacobian is handed to the solver
+
+	a solve that does not converge warns, and leaves info['converged']
+	False, which callers check
 	"""
-	def solve(self):
-		solution = [None]*len(self.mapping)
-		for ix, (i,k) in enumerate(self.mapping):
-			solution[ix] = self.b[i].state[k]
-		solution = fsolve(self.r, solution)
+	def solve(self,method = 'fsolve',**options):
+		if self.batch is not None and method in ('newton-sparse','newton-krylov','newton-multigrid'):
+			# the operating points are independent, each is line searched
+			# and stops on its own
+			options.setdefault('groups',np.tile(np.arange(self.batch),len(self.mapping)))
+		if method == 'fsolve':
+			solution, infodict, ier, message = fsolve(self.r, self.getSolution(), \
+				fprime = lambda x: self.jacobian(x).toarray(),full_output = True)
+			self.info = {'nfev':infodict['nfev'],'njev':infodict['njev'], \
+				'norm':np.linalg.norm(infodict['fvec']),'converged':ier == 1,'message':message}
+			if ier != 1:
+				warnings.warn(message,RuntimeWarning)
+		elif method == 'newton-sparse':
+			solution, self.info = newton.newton(self.r,self.getSolution(),self.jacobian,**options)
+		elif method == 'newton-krylov':
+			options.setdefault('linear','gmres')
+			x0 = self.getSolution()
+			# the preconditioner is lagged, the products use the current states
+			M = newton.ilu(self.jacobian(x0))
+			solution, self.info = newton.newton(self.r,x0, \
+				lambda x: newton.jacobianFree(self.r,x,M),**options)
+		elif method == 'newton-multigrid':
+			# structured grids are agglomerated geometrically
+			shapes = None
+			if len(self.grids) == len(self.b) and self.batch is None:
+				shapes = [g.shape for g in self.grids for k in g.state]
+			# the levels are built at the first Newton step, and kept
+			# for the others unless GMRES stops converging with them
+			cache = {}
+			options['linear'] = lambda J,b,tol: multigrid.solve(J,b,shapes,tol,cache)
+			# the V-cycles are cheap next to building the levels,
+			# so solve each Newton step tightly
+			options.setdefault('eta',1e-8)
+			solution, self.info = newton.newton(self.r,self.getSolution(),self.jacobian,**options)
+		elif method == 'newton-triangular':
+			self.solveTriangular(**options)
+			solution = self.getSolution()
+		else:
+			raise ValueError('unknown solve method ' + str(method))
+		if self.batch is not None and 'rows' not in self.info:
+			# the operating points do not depend on each other, so those
+			# within the target norm have converged, even if others have not
+			norms = np.sqrt(np.sum(np.reshape(self.r(solution),self.x.shape)**2,axis=0))
+			target = self.info.get('target',np.inf if self.info['converged'] else 0.)
+			self.info['norms'] = norms
+			self.info['rows'] = np.isfinite(norms) & (norms <= target)
+		if self.stats is not None:
+			self.stats['solve'] = dict((k,v) for k,v in self.info.iteritems() if k != 'jacobian')
 		self.update(solution)
 
 	"""
@@ -90,21 +774,88 @@ class Problem(object):
 	input(s):   (ti) initial time
 							(tf) final time
 							(n)  number of timesteps
-	output(s):	None
+							(out) optional .npy file name to keep the trajectory in
+							(method) 'lsoda' (default), odeint's LSODA, or the
+								implicit 'BDF' or 'Radau' methods for stiff problems,
+								which are handed the sparse colored Jacobian
+							(rtol, atol) relative and absolute tolerances
+	output(s):	None, or the trajectory as a read-only memmap if out is given
 
 	unwraps blocks, passes into solver, finishes by updating blocks one last time
+
+	with out, the solution at each of the n times is written to disk as
+	it is computed, as an (n, len(mapping)) array (with a third axis for a
+	batch), so the history is never held in memory. The times and labels
+	are kept alongside it, see loadTrajectory
 	"""
-	def solveUnst(self,ti,tf,n):
-		solnPoints = {}
-		solution = [None]*len(self.mapping)
+	def solveUnst(self,ti,tf,n,out = None,method = 'lsoda',rtol = 1.49012e-8,atol = 1.49012e-8):
+		if method not in ('lsoda','BDF','Radau'):
+			raise ValueError('unknown solveUnst method ' + str(method))
 		# This has the unsteady part
 		# Solver, just live and let live	
-		for ix, (i,k) in enumerate(self.mapping):
-			solution[ix] = self.b[i].state[k]
+		solution = self.getSolution()
 		t = np.linspace(ti,tf,n)
-		soln = odeint(self.r, solution, t)
+		if out is None and method == 'lsoda':
+			soln = odeint(self.r, solution, t, rtol = rtol, atol = atol)
+			# final update
+			self.update(soln[-1,:],t[-1])
+			return
+		soln = None
+		if out is not None:
+			shape = (n,) + (np.shape(self.x) if self.array else (len(self.mapping),))
+			soln = np.lib.format.open_memmap(out,mode='w+',dtype=float,shape=shape)
+			np.savez(os.path.splitext(out)[0] + '.npz',t=t,labels=np.array(self.labels()))
+			soln[0] = np.reshape(solution,shape[1:])
+		rhs = lambda t,x: self.r(x,t)
+		if method == 'lsoda':
+			# the same LSODA method as odeint, stepped so each time
+			# can be written out
+			ode = integrate.ode(rhs).set_integrator('lsoda',rtol = rtol,atol = atol)
+			ode.set_initial_value(solution,t[0])
+			for j in range(1,n):
+				solution = ode.integrate(t[j])
+				if not ode.successful():
+					raise RuntimeError('solveUnst failed at t = ' + str(t[j-1]))
+				if soln is not None:
+					soln[j] = np.reshape(solution,shape[1:])
+		else:
+			# implicit steps, with the Jacobian from the flux sparsity
+			# the output times are interpolated from each step
+			solver = getattr(integrate,method)(rhs,t[0],solution,t[-1], \
+				jac = lambda t,x: self.jacobian(x,t),rtol = rtol,atol = atol)
+			j = 1
+			while j < n:
+				solver.step()
+				if solver.status == 'failed':
+					raise RuntimeError('solveUnst failed at t = ' + str(solver.t))
+				dense = solver.dense_output()
+				while j < n and t[j] <= solver.t:
+					solution = dense(t[j]) if j < n-1 else solver.y
+					if soln is not None:
+						soln[j] = np.reshape(solution,shape[1:])
+					j += 1
 		# final update
-		self.update(soln[-1,:],t[-1])
+		self.update(solution,t[-1])
+		if soln is not None:
+			soln.flush()
+			del soln
+			return np.load(out,mmap_mode='r')
+
+	"""
+	labels:			names of the global states, ordered as mapping,
+							'block:state' or 'grid:state[i,j]'
+
+	input(s):   None
+	output(s):	list of strings
+	"""
+	def labels(self):
+		names = []
+		for i,k in self.mapping:
+			if isinstance(k,tuple):
+				names.append('%s:%s[%d,%d]' % ((self.b[i].name,) + k))
+			else:
+				names.append('%s:%s' % (self.b[i].name,k))
+		return names
 
 	"""
 	printSolution:		Outputs solution to screen
@@ -113,6 +864,39 @@ class Problem(object):
 		for b in self.b:
 			b.printMe()
 
+"""
+timer:			wraps a function to count its calls and time them
+
+input(s):   (f) function
+						(table) dict to keep the counts in
+						(name) key of the entry in table, {'calls':n,'time':seconds},
+							shared by every function timed under that name
+output(s):	the wrapped function, with the original as .wrapped
+"""
+def timer(f,table,name):
+	entry = table.setdefault(name,{'calls':0,'time':0.})
+	def timed(*args,**kwargs):
+		start = time.time()
+		try:
+			return f(*args,**kwargs)
+		finally:
+			entry['calls'] += 1
+			entry['time'] += time.time() - start
+	timed.wrapped = f
+	return timed
+
+"""
+loadTrajectory:	reads a trajectory written by Problem.solveUnst
+
+input(s):   (out) the .npy file name given to solveUnst
+output(s):	(t) times
+						(labels) names of the states, see Problem.labels
+						(soln) trajectory as a read-only memmap, one row per time
+"""
+def loadTrajectory(out):
+	index = np.load(os.path.splitext(out)[0] + '.npz')
+	return index['t'], list(index['labels']), np.load(out,mmap_mode='r')
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
@@ -2,9 +2,12 @@
 source.py contains the Source class
 
 Each Source has:
+	(.s) source function name
 	(.S) source function, evaluated 
   (.p) parameters
 
+Source functions are looked up by name in the kernels registry,
+new ones are added with register, as for fluxes (see flux.py)
 
 ------------------------------------
 function tests are run by doctest
@@ -18,8 +21,15 @@ python blocks.py
 >>> b.state['T'] = 10.0
 >>> Sa.S(b)['T']
 0.5
+>>> f = table([0.,1.,2.],[[0.,10.],[1.,20.],[4.,40.]])
+>>> f(0.5)
+array([ 0.5, 15. ])
+>>> f(3.)
+array([ 4., 40.])
 
 """
+import numpy as np
+
 class Source(object):
 	""" 
 	Source Class
@@ -28,8 +38,12 @@ class Source(object):
 							(parameters) optional dictionary with arguments for the source functions
 	output(s):	None
 	"""
+	# source functions that do not depend on the block state
+	constant = set()
+
 	def __init__(self,s,**parameters):
-		self.S = eval('self.'+s)
+		self.s = s
+		self.S = kernels[s].__get__(self,Source)
 		self.p = parameters
 	"""
 	input(s):   (b) Block
@@ -43,6 +57,44 @@ class Source(object):
 	def time(self,b):
 		return dict([(state,self.p[state](b.t)) for state in b.state])
 
+# source functions by name
+kernels = {}
+
+"""
+register:		adds a source function to the kernels
+
+input(s):   (name) source function name, as passed to Source
+						(S) source function, S(source,block) returns a dict of states 
+						(constant) True if it does not depend on the block state
+output(s):	None
+"""
+def register(name,S,constant = False):
+	kernels[name] = S
+	if constant:
+		Source.constant.add(name)
+	else:
+		Source.constant.discard(name)
+
+register('const',Source.__dict__['const'],constant = True)
+register('time',Source.__dict__['time'],constant = True)
+
+"""
+table:			interpolates a table of values in time
+
+input(s):   (times) increasing times
+						(values) values at each time, one row (array) per time
+output(s):	function of t, linearly interpolating all the values at once,
+						and holding the first or last row outside the table
+"""
+def table(times,values):
+	times = np.asarray(times,dtype=float)
+	values = np.asarray(values,dtype=float)
+	def interpolate(t):
+		j = min(max(np.searchsorted(times,t),1),len(times)-1)
+		w = min(max((t - times[j-1])/(times[j] - times[j-1]),0.),1.)
+		return (1.-w)*values[j-1] + w*values[j]
+	return interpolate
+
 if __name__ == "__main__":
 	import doctest
 	import blocks
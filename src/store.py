@@ -0,0 +1,250 @@
+"""
+store.py saves constructed Problems to .npz files, and loads them back
+
+Building a large block graph (poisson2D.py, diffusion2D.py) runs
+python loops and evals for every block and flux, which can take longer
+than the solve. A saved Problem is rebuilt from flat arrays, without
+running the construction script again.
+
+A file holds, as arrays
+	every block, those solved for, the boundary blocks and the
+		neighbours of their fluxes, with their material, time, states
+		and any numerical attributes added to them (eg. mdot)
+	every flux, by its block, neighbour, kernel name and geometry,
+		with the geometries (shared between fluxes) kept once
+	every structured grid (grid.py), by its name, geometry, time,
+		state arrays and cell positions
+	every source, by kernel name and parameters, and the blocks using it,
+		or the grids using it on their interior or their ghost cells
+	the Problem's blocks and grids, boundary blocks and whether it is
+		array-backed
+	the Jacobian sparsity pattern and column colors, which are set on
+		the loaded Problem rather than found again
+
+Only numerical sources can be saved, not batches, time sources or
+boundary drivers (functions). Declared parameters are not saved either,
+and are declared again after loading.
+
+------------------------------------
+function tests are run by doctest
+python store.py
+------------------------------------
+>>> import os, tempfile, flux, source
+>>> a = blocks.Block('a',None,u = 1.)
+>>> c = blocks.Block('c','air',u = 0.)
+>>> c.mdot = 0.5
+>>> c.addFlux(flux.Flux(a,'difference',{'d':1.,'m':[]}))
+>>> c.addSource(source.Source('const',u = 2.))
+>>> name = os.path.join(tempfile.mkdtemp(),'test.npz')
+>>> save(problem.Problem([c],array = True),name)
+>>> P = load(name)
+>>> P.solve('newton-sparse')
+>>> P.b[0].name, P.b[0].state['u'], P.b[0].mdot, P.b[0].m['name']
+('c', 3.0, 0.5, 'air')
+>>> u = np.zeros((4,5))
+>>> u[0,:] = 1.
+>>> g = grid.Grid('g',{'type':'edge','d':1.},u = u)
+>>> g.addSource(source.Source('const',u = np.ones((2,3))))
+>>> Q = problem.Problem([g])
+>>> save(Q,name)
+>>> P = load(name)
+>>> (P.pattern != Q.sparsity()).nnz, np.array_equal(P.colors,Q.colors)
+(0, True)
+>>> P.solve('newton-sparse')
+>>> np.round(P.b[0].state['u'][1:-1,1:-1],6)
+array([[0.987578, 1.223602, 0.987578],
+       [0.726708, 0.919255, 0.726708]])
+"""
+import json
+import numpy as np
+import scipy.sparse as sp
+import blocks
+import grid
+import flux
+import source
+import problem
+import materials
+
+# Block and Flux attributes that are saved in their own arrays
+blockAttributes = set(['name','m','state','F','S','t'])
+fluxAttributes = set(['B','N','f','F','m','G'])
+# and Grid attributes that are saved, or found again by the constructor
+gridAttributes = set(['name','G','state','S','bc','F','t','shape','ring','views','offset','position'])
+
+def encode(v):
+	""" v as plain python values for json, or None if it cannot be saved """
+	if isinstance(v,np.ndarray) or isinstance(v,np.generic):
+		v = v.tolist()
+	try:
+		json.dumps(v)
+		return v
+	except TypeError:
+		return None
+
+def extras(o,saved):
+	""" the numerical (json-able) attributes of o not in saved """
+	E = {}
+	for k,v in o.__dict__.iteritems():
+		if k not in saved and not callable(v):
+			e = encode(v)
+			if e is not None:
+				E[k] = e
+	return E
+
+"""
+save:				writes a Problem to a .npz file
+
+input(s):   (P) Problem of blocks and grids
+						(filename) file name
+output(s):	None
+"""
+def save(P,filename):
+	if P.batch is not None:
+		raise ValueError('Problems with a batch cannot be saved')
+	if P.boundary is not None:
+		raise ValueError('boundary drivers cannot be saved')
+	# every block, numbered. The extra attributes, geometries and
+	# source parameters are kept as json, each list as one string
+	B = []
+	index = {}
+	def add(b):
+		if id(b) not in index:
+			index[id(b)] = len(B)
+			B.append(b)
+	grids = P.grids
+	for b in P.b + P.bc:
+		if not isinstance(b,grid.Grid):
+			add(b)
+	for b in B[:]:
+		for F in b.F:
+			add(F.N)
+	names = dict((id(v),k) for k,v in materials.__dict__.iteritems() if isinstance(v,dict))
+	for b in B:
+		if b.m and id(b.m) not in names:
+			raise ValueError('block ' + str(b.name) + ' has a material not in materials.py')
+	data = {}
+	data['blockName'] = np.array([b.name for b in B])
+	data['blockMaterial'] = np.array([names[id(b.m)] if b.m else '' for b in B])
+	data['blockTime'] = np.array([b.t for b in B],dtype=float)
+	data['blockExtras'] = np.array(json.dumps([extras(b,blockAttributes) for b in B]))
+	S = [(i,k,v) for i,b in enumerate(B) for k,v in b.state.items()]
+	data['stateBlock'] = np.array([i for i,k,v in S],dtype=int)
+	data['stateKey'] = np.array([k for i,k,v in S])
+	data['stateValue'] = np.array([v for i,k,v in S],dtype=float)
+	# fluxes in the order of the blocks, with their geometries kept once
+	geometry = {}
+	geometries = []
+	fluxes = [F for b in B for F in b.F]
+	for F in fluxes:
+		G = getattr(F,'G',None)
+		if G is not None and id(G) not in geometry:
+			geometry[id(G)] = len(geometries)
+			geometries.append(json.dumps(G))
+	data['geometry'] = np.array(geometries)
+	data['fluxBlock'] = np.array([index[id(F.B)] for F in fluxes],dtype=int)
+	data['fluxNeighbour'] = np.array([index[id(F.N)] for F in fluxes],dtype=int)
+	data['fluxKernel'] = np.array([F.f for F in fluxes])
+	data['fluxGeometry'] = np.array([geometry[id(F.G)] if getattr(F,'G',None) is not None else -1 \
+		for F in fluxes],dtype=int)
+	data['fluxExtras'] = np.array(json.dumps([extras(F,fluxAttributes) for F in fluxes]))
+	# grids, with each state (ghost cells included) and the
+	# coordinates of the cells as arrays of their own
+	data['gridName'] = np.array([g.name for g in grids])
+	data['gridGeometry'] = np.array(json.dumps([g.G for g in grids]))
+	data['gridTime'] = np.array([g.t for g in grids],dtype=float)
+	data['gridStates'] = np.array(json.dumps([g.state.keys() for g in grids]))
+	data['gridExtras'] = np.array(json.dumps([extras(g,gridAttributes) for g in grids]))
+	for i,g in enumerate(grids):
+		for k,v in g.state.iteritems():
+			data['grid' + str(i) + 'State' + k] = v
+		if getattr(g,'position',None) is not None:
+			data['grid' + str(i) + 'Position'] = np.array([np.asarray(X,dtype=float) for X in g.position])
+	# sources, shared between blocks and grids, kept once
+	sources = {}
+	parameters = []
+	def register(s,owner):
+		if id(s) not in sources:
+			p = dict((k,encode(v)) for k,v in s.p.iteritems())
+			if None in p.values():
+				raise ValueError('source ' + s.s + ' of ' + str(owner.name) + ' cannot be saved')
+			sources[id(s)] = len(parameters)
+			parameters.append((s.s,p))
+		return sources[id(s)]
+	links = [(i,register(s,b)) for i,b in enumerate(B) for s in b.S]
+	gridLinks = [(i,register(s,g)) for i,g in enumerate(grids) for s in g.S]
+	gridBoundaries = [(i,register(s,g)) for i,g in enumerate(grids) for s in g.bc]
+	data['sourceKernel'] = np.array([s for s,p in parameters])
+	data['sourceParameters'] = np.array(json.dumps([p for s,p in parameters]))
+	data['sourceBlock'] = np.array([i for i,j in links],dtype=int)
+	data['sourceIndex'] = np.array([j for i,j in links],dtype=int)
+	data['gridSourceGrid'] = np.array([i for i,j in gridLinks],dtype=int)
+	data['gridSourceIndex'] = np.array([j for i,j in gridLinks],dtype=int)
+	data['gridBoundaryGrid'] = np.array([i for i,j in gridBoundaries],dtype=int)
+	data['gridBoundaryIndex'] = np.array([j for i,j in gridBoundaries],dtype=int)
+	# the Problem's blocks by number, and its grids as -1 - their number
+	gridIndex = dict((id(g),i) for i,g in enumerate(grids))
+	data['problemBlocks'] = np.array([-1 - gridIndex[id(b)] if id(b) in gridIndex else index[id(b)] \
+		for b in P.b],dtype=int)
+	data['problemBoundaries'] = np.array([index[id(b)] for b in P.bc],dtype=int)
+	data['problemArray'] = np.array(P.array)
+	pattern = P.sparsity()
+	data['patternIndptr'] = pattern.indptr
+	data['patternIndices'] = pattern.indices
+	data['colors'] = P.colors
+	np.savez_compressed(filename,**data)
+
+"""
+load:				reads a Problem written by save
+
+input(s):   (filename) file name
+output(s):	Problem, ready to solve
+"""
+def load(filename):
+	data = np.load(filename)
+	B = [blocks.Block(name,m or None,t) for (name,m,t) in \
+		zip(data['blockName'].tolist(),data['blockMaterial'].tolist(),data['blockTime'].tolist())]
+	for b,E in zip(B,json.loads(str(data['blockExtras']))):
+		for k,v in E.iteritems():
+			setattr(b,k,v)
+	for i,k,v in zip(data['stateBlock'].tolist(),data['stateKey'].tolist(),data['stateValue'].tolist()):
+		B[i].state[k] = v
+	geometries = [json.loads(G) for G in data['geometry'].tolist()]
+	for (i,j,f,g,E) in zip(data['fluxBlock'].tolist(),data['fluxNeighbour'].tolist(), \
+		data['fluxKernel'].tolist(),data['fluxGeometry'].tolist(),json.loads(str(data['fluxExtras']))):
+		F = flux.Flux(B[j],f,geometries[g] if g >= 0 else None)
+		for k,v in E.iteritems():
+			setattr(F,k,v)
+		B[i].addFlux(F)
+	grids = []
+	for i,(name,G,t,keys,E) in enumerate(zip(data['gridName'].tolist(), \
+		json.loads(str(data['gridGeometry'])),data['gridTime'].tolist(), \
+		json.loads(str(data['gridStates'])),json.loads(str(data['gridExtras'])))):
+		g = grid.Grid(name,G,t,**dict((str(k),data['grid' + str(i) + 'State' + k]) for k in keys))
+		if 'grid' + str(i) + 'Position' in data:
+			g.position = tuple(data['grid' + str(i) + 'Position'])
+		for k,v in E.iteritems():
+			setattr(g,k,v)
+		grids.append(g)
+	# lists of numbers were arrays (eg. the values of a source over a grid)
+	value = lambda v: np.array(v,dtype=float) if isinstance(v,list) else v
+	S = [source.Source(s,**dict((str(k),value(v)) for k,v in p.iteritems())) \
+		for s,p in zip(data['sourceKernel'].tolist(),json.loads(str(data['sourceParameters'])))]
+	for i,j in zip(data['sourceBlock'].tolist(),data['sourceIndex'].tolist()):
+		B[i].addSource(S[j])
+	for i,j in zip(data['gridSourceGrid'].tolist(),data['gridSourceIndex'].tolist()):
+		grids[i].addSource(S[j])
+	for i,j in zip(data['gridBoundaryGrid'].tolist(),data['gridBoundaryIndex'].tolist()):
+		grids[i].addBoundary(S[j])
+	P = problem.Problem([B[i] if i >= 0 else grids[-1-i] for i in data['problemBlocks'].tolist()], \
+		[B[i] for i in data['problemBoundaries']],array = bool(data['problemArray']))
+	n = len(P.mapping)
+	if len(data['patternIndptr']) != n + 1 or len(data['colors']) != n:
+		raise ValueError(filename + ' does not match the Problem it describes')
+	P.pattern = sp.csr_matrix((np.ones(len(data['patternIndices']),dtype=bool), \
+		data['patternIndices'],data['patternIndptr']),shape=(n,n))
+	P.colors = data['colors']
+	return P
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()
@@ -0,0 +1,119 @@
+"""
+stream.py contains generators for reading and writing experimental data
+
+Experiment files are csv files with a header, and can have any
+line endings (\\n, \\r\\n, or old Mac \\r, as nov25.csv). They are read
+a block of bytes at a time and handed out in chunks of rows, with the
+numerical columns converted to float arrays, so a file of any length
+can be processed in constant memory.
+
+Each chunk is a pair of dicts of columns, the float columns as arrays
+(nan where a value is missing or not a number), and the string
+columns as lists of the text in the file.
+
+------------------------------------
+function tests are run by doctest
+python stream.py
+------------------------------------
+>>> from StringIO import StringIO
+>>> list(lines(StringIO('a\\r\\nb\\rc\\nd'),size = 2))
+['a', 'b', 'c', 'd']
+>>> f = StringIO('a,b,c\\r1,2,x\\r3,,y\\r\\r5,6,z\\r')
+>>> C = list(chunks(f,['a','b'],['a','c'],size = 2))
+>>> (values,text) = C[0]
+>>> values['a'], values['b'], text['c']
+(array([1., 3.]), array([ 2., nan]), ['x', 'y'])
+>>> C[1][0]['a']
+array([5.])
+>>> out = StringIO()
+>>> write(csv.writer(out),['c','a'],C[1][1])
+>>> out.getvalue()
+'z,5\\r\\n'
+"""
+import csv
+import numpy as np
+
+"""
+lines:			the lines of a file, without their line endings
+
+input(s):   (f) file object
+						(size) number of bytes read at a time
+output(s):	generator of lines
+"""
+def lines(f,size = 1 << 16):
+	tail = ''
+	while True:
+		block = f.read(size)
+		if not block:
+			break
+		parts = (tail + block).splitlines(True)
+		# the last line may be incomplete, or a \r waiting for its \n
+		tail = parts.pop()
+		if tail.endswith('\n'):
+			parts.append(tail)
+			tail = ''
+		for l in parts:
+			yield l.rstrip('\r\n')
+	if tail:
+		yield tail.rstrip('\r\n')
+
+"""
+number:			converts a string to a float, nan if it is not a number
+"""
+def number(s):
+	try:
+		return float(s)
+	except ValueError:
+		return np.nan
+
+"""
+chunks:			chunks of rows of a csv file with a header
+
+input(s):   (f) file object
+						(floats) names of the columns to convert to float arrays
+						(strings) names of the columns to keep as strings
+						(size) number of rows per chunk
+output(s):	generator of (values, text), dicts of the float
+							and the string columns of each chunk
+
+empty rows are skipped
+"""
+def chunks(f,floats,strings = [],size = 4096):
+	reader = csv.reader(lines(f))
+	header = reader.next()
+	columns = [(c,header.index(c)) for c in floats]
+	text = [(c,header.index(c)) for c in strings]
+	buf = []
+	for row in reader:
+		if not any(row):
+			continue
+		buf.append(row)
+		if len(buf) == size:
+			yield chunk(buf,columns,text)
+			buf = []
+	if buf:
+		yield chunk(buf,columns,text)
+
+def chunk(rows,columns,text):
+	values = {}
+	for (c,i) in columns:
+		values[c] = np.array([number(row[i]) if i < len(row) else np.nan for row in rows])
+	strings = {}
+	for (c,i) in text:
+		strings[c] = [row[i] if i < len(row) else '' for row in rows]
+	return (values,strings)
+
+"""
+write:			writes a chunk of rows
+
+input(s):   (w) csv writer
+						(columns) names of the columns to write, in order
+						(C) chunk, dict of columns
+output(s):	None
+"""
+def write(w,columns,C):
+	w.writerows(zip(*[C[c] for c in columns]))
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod()